@@ -1,8 +1,8 @@
 #!/usr/bin/python
 
 import os
-import yaml
 import copy
+import string
 
 # Import: broadcast, exitcode
 #import broadcast
@@ -13,12 +13,95 @@ import copy
 """Processor for YAML files dealing with both input, output and conversion
 of handles."""
 
+cache_dir = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'treerun'
+)
+
+# Number of normalized configs (e.g. one per modifier) kept per YAML file
+cache_size = 8
+
+def safe_load(stream) -> dict:
+    """Loads YAML data, using the C-accelerated loader if libyaml is 
+    available.
+
+    PyYAML is imported here, rather than at the top, so that commands that
+    never read an input file do not have to import it.
+    """
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(stream, Loader=loader)
+
 def load_input(yaml_file:str) -> dict:
     """Loads a YAML file."""
     with open(yaml_file, 'r') as f:
-        yaml_data = yaml.safe_load(f)
+        yaml_data = safe_load(f)
     return yaml_data
 
+def load_cached(yaml_file:str, normalize, key:tuple=(), use_cache:bool=True) -> tuple:
+    """Loads a YAML file and returns its contents along with a normalized 
+    version of it.
+
+    Both are stored in a binary cache that is keyed by the path, the 
+    modification time and the content hash of the file, so that repeated
+    calls on an unchanged file skip parsing and normalization entirely.
+
+    Keyword arguments:
+      yaml_file:  the YAML file
+      normalize:  function that returns the normalized version of the contents
+      key:        values, other than the contents, that the normalized version
+                  depends on
+      use_cache:  disables the cache if False
+    """
+    if not use_cache:
+        yaml_data = load_input(yaml_file)
+        return yaml_data, normalize(yaml_data)
+
+    import pickle
+    import hashlib
+
+    with open(yaml_file, 'rb') as f:
+        content = f.read()
+    path = os.path.abspath(yaml_file)
+    file_key = (
+        path,
+        os.stat(yaml_file).st_mtime_ns,
+        hashlib.sha256(content).hexdigest(),
+    )
+    cache_file = os.path.join(cache_dir, hashlib.sha1(path.encode()).hexdigest()+'.pickle')
+
+    # A missing, outdated or broken cache is simply rebuilt
+    try:
+        with open(cache_file, 'rb') as f:
+            cache = pickle.load(f)
+    except Exception:
+        cache = {}
+    if cache.get('file') == file_key and key in cache['normalized']:
+        return cache['yaml_data'], cache['normalized'][key]
+    if cache.get('file') != file_key:
+        cache = dict(
+            file=file_key,
+            yaml_data=safe_load(content),
+            normalized={},
+        )
+
+    normalized = normalize(cache['yaml_data'])
+    cache['normalized'][key] = normalized
+    while len(cache['normalized']) > cache_size:
+        del cache['normalized'][next(iter(cache['normalized']))]
+
+    # Written to a temporary file first so that concurrent runs never read 
+    # a partial cache. Failing to write (e.g. read-only home) is not an error
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return cache['yaml_data'], normalized
+
 def convert_handles(data:dict or str, handle_map:dict) -> dict:
     """Converts placeholders/handles in a data defined a handle map.
 
@@ -71,6 +154,87 @@ def convert_handles(data:dict or str, handle_map:dict) -> dict:
 
     return tmp
 
+class Template:
+    """A string with placeholders/handles that is parsed once and can then be
+    rendered any number of times.
+
+    The string is split into literal text and placeholder slots when the 
+    template is created, so that rendering only has to fill in the slots.
+
+    Attributes:
+      string:   the original string
+      slots:    list of (literal text, field name, conversion, format spec)
+      fields:   names of all placeholders in the string
+
+    Methods:
+      text:     returns the literal text of the template
+      missing:  returns the placeholders that are not among the given names
+      bind:     returns a template where some of the placeholders are filled
+      render:   returns the string with all placeholders filled
+    """
+    def __init__(self, template:str, slots:list=None) -> None:
+        self.string = template
+        if slots is None:
+            slots = []
+            for literal, field, spec, conversion in string.Formatter().parse(template):
+                slots.append((literal, field, conversion, spec))
+        self.slots = slots
+        self.fields = [self.name(f) for _, f, _, _ in self.slots if f is not None]
+
+    @staticmethod
+    def name(field:str) -> str:
+        """Returns the name of a field, e.g. 'a' for 'a.b' or 'a[0]'."""
+        return field.partition('.')[0].partition('[')[0]
+
+    @staticmethod
+    def fill(field:str, conversion:str, spec:str, handle_map:dict) -> str:
+        """Returns a single slot of a template filled from a handle map."""
+        value, _ = string.Formatter().get_field(field, (), handle_map)
+        if conversion == 'r':
+            value = repr(value)
+        elif conversion == 'a':
+            value = ascii(value)
+        elif conversion == 's':
+            value = str(value)
+        return format(value, spec)
+
+    def text(self) -> str:
+        """Returns the literal text of the template, without placeholders."""
+        return ''.join(text for text, _, _, _ in self.slots)
+
+    def missing(self, names:list) -> list:
+        """Returns the placeholders that are not among the given names."""
+        names = set(names)
+        return [f for f in dict.fromkeys(self.fields) if f not in names]
+
+    def bind(self, handle_map:dict) -> 'Template':
+        """Returns a new template where all placeholders defined in the 
+        handle map have been filled, while the rest are left as slots.
+        """
+        slots, literal = [], ''
+        for text, field, conversion, spec in self.slots:
+            literal += text
+            if field is None:
+                continue
+            elif self.name(field) in handle_map:
+                literal += self.fill(field, conversion, spec, handle_map)
+            else:
+                slots.append((literal, field, conversion, spec))
+                literal = ''
+        if literal != '':
+            slots.append((literal, None, None, None))
+        return Template(self.string, slots)
+
+    def render(self, handle_map:dict) -> str:
+        """Returns the string with all placeholders filled from a handle map."""
+        parts = []
+        for text, field, conversion, spec in self.slots:
+            parts.append(text)
+            if field is not None:
+                parts.append(self.fill(field, conversion, spec, handle_map))
+        return ''.join(parts)
+
+
 def yaml_from_paths():
     """Genrerate YAML tree from paths. The tree should be printed and the 
     user can save it manually, or be able to use '>'. It must therefore be a
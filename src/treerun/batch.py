@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+import os
+import time
+import shlex
+import datetime
+
+from treerun import broadcast
+from treerun import YAMLutils
+from treerun import runner
+
+"""Methods for submitting all nodes of a mode as a single job array, instead
+of submitting one job per node."""
+
+launcher_template = """#!/bin/sh
+# Generated by treerun: runs the entry of the job array manifest that
+# corresponds to the array index of this task.
+index=${{{index_var}:?array index variable {index_var} is not set}}
+line=$(sed -n "$((index-{first}+1))p" {manifest})
+[ -n "$line" ] || {{ echo "No entry for array index $index" >&2; exit 1; }}
+dir=$(printf '%s\\n' "$line" | cut -f1)
+cmd=$(printf '%s\\n' "$line" | cut -f2-)
+cd "$dir" && exec /bin/sh -c "$cmd"
+"""
+
+# Placeholders that can be used in the submit command
+submit_handles = ['manifest', 'launcher', 'count', 'first', 'last']
+
+
+def get_settings(array:dict or str) -> dict:
+    """Returns the settings of the 'array' option of a mode with defaults
+    filled in. The option is either the submit command itself or a block
+    with the keys 'submit', 'index' (the environment variable that holds the
+    array index of a task), 'first' (index of the first task) and 'dir'
+    (where the manifest and launcher are written, relative to the root-dir).
+    """
+    if type(array) == str:
+        array = dict(submit=array)
+    return dict(
+        submit=array['submit'],
+        index=array.get('index', 'SLURM_ARRAY_TASK_ID'),
+        first=int(array.get('first', 0)),
+        dir=array.get('dir', '.treerun'),
+    )
+
+
+def write_manifest(tasks:list, root_dir:str, manifest_file:str) -> None:
+    """Writes one line per task with the run directory and the command
+    separated by a tab.
+    """
+    with open(manifest_file, 'w') as f:
+        for path, cmd in tasks:
+            cmd = runner.command_string(cmd)
+            if ('\n' in cmd) or ('\t' in path):
+                raise ValueError(f'Cannot write {path} to a job array manifest.')
+            f.write(f'{root_dir+path}\t{cmd}\n')
+
+
+def write_launcher(launcher_file:str, manifest_file:str, index_var:str, first:int) -> None:
+    """Writes the script that each task of the array runs."""
+    with open(launcher_file, 'w') as f:
+        f.write(launcher_template.format(
+            index_var=index_var,
+            first=first,
+            manifest=shlex.quote(manifest_file),
+        ))
+    os.chmod(launcher_file, 0o755)
+
+
+def submit(tasks:list, root_dir:str, settings:dict, handle_map:dict, observers:list=()) -> list:
+    """Submits a list of (path, command) tasks as a single job array and
+    returns one record per task (see runner.run_node). The tasks of an array
+    that was submitted have no exit status yet and are recorded with the 
+    reason 'submitted', so that they do not count as completed when a run
+    is resumed, while all tasks share the exit status of a failed submission.
+
+    Keyword arguments:
+      tasks:       list of (path, command) pairs
+      root_dir:    root-dir that contains the tree structure
+      settings:    settings of the job array (see get_settings)
+      handle_map:  placeholders that can be used in the submit command, in
+                   addition to those of the array
+      observers:   objects whose 'started' and 'finished' methods are called
+                   for each task
+    """
+    import subprocess
+    if len(tasks) == 0:
+        return []
+
+    # Each submission gets its own files, since earlier arrays may still be
+    # reading theirs
+    array_dir = os.path.join(root_dir, settings['dir'])
+    os.makedirs(array_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    manifest_file = os.path.join(array_dir, f'array-{stamp}.manifest')
+    launcher_file = os.path.join(array_dir, f'array-{stamp}.sh')
+    write_manifest(tasks, root_dir, manifest_file)
+    write_launcher(launcher_file, manifest_file, settings['index'], settings['first'])
+
+    cmd = YAMLutils.Template(settings['submit']).render(
+        handle_map | dict(
+            manifest=manifest_file,
+            launcher=launcher_file,
+            count=len(tasks),
+            first=settings['first'],
+            last=settings['first']+len(tasks)-1,
+        )
+    )
+    broadcast.tabulate(
+        {
+            'Tasks:':len(tasks),
+            'Manifest:':manifest_file,
+            'Running:':cmd,
+        }
+    )
+
+    tasks = [(path, runner.command_string(task_cmd)) for path, task_cmd in tasks]
+    for path, task_cmd in tasks:
+        for observer in observers:
+            observer.started(path, task_cmd)
+    start, clock = datetime.datetime.now(), time.perf_counter()
+    status = subprocess.call(cmd, shell=True, cwd=root_dir)
+    end, duration = datetime.datetime.now(), time.perf_counter()-clock
+
+    records = []
+    for path, task_cmd in tasks:
+        record = dict(
+            path=path,
+            cmd=task_cmd,
+            start=start.isoformat(),
+            end=end.isoformat(),
+            duration=duration,
+            status=None if status == 0 else status,
+            utime=None,
+            stime=None,
+            maxrss=None,
+            stdout=None,
+            stderr=None,
+        )
+        if status == 0:
+            record['reason'] = 'submitted'
+        for observer in observers:
+            observer.finished(record)
+        records.append(record)
+    return records
@@ -1,53 +1,214 @@
 #!/usr/bin/python
 
 import os
-import sys
+import math
 import itertools
 import functools
+from array import array
 
 from treerun import broadcast
-import treerun.main as trm
+from treerun.exitcode import ExitCode
 
 """Methods for obtaining, pruning/grafting and checking the existence of
 paths."""
 
-def graft_paths(paths:list, graft_point:str) -> list:
-    """Given a list of paths, returns a list of paths grafted and grafted 
-    with a new path specified as a mode dir in the input.
+class DirIndex:
+    """Index of the sub-directories in a tree, used to check the existence of
+    paths without issuing one system call per path.
 
-    In practise this is used to run commands from non-endpoint nodes.
+    Each directory is listed (using os.scandir) at most once, the first time
+    one of its children is looked up, after which existence checks are set 
+    lookups.
+
+    Attributes:
+      root_dir:  root-dir that contains the tree structure
+      listings:  names of the sub-directories of each listed directory
+
+    Methods:
+      listdir:   returns the names of the sub-directories of a path
+      isdir:     checks if a path is an existing directory
+      clear:     forgets all listings, e.g. after directories were created
+    """
+    def __init__(self, root_dir:str) -> None:
+        self.root_dir = root_dir
+        self.listings = {}
+
+    def listdir(self, path:str) -> set:
+        """Returns the set of sub-directory names of a path relative to the 
+        root-dir (an empty set if the path is not a directory).
+        """
+        if path not in self.listings:
+            try:
+                with os.scandir(self.root_dir+path) as entries:
+                    self.listings[path] = {e.name for e in entries if e.is_dir()}
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                self.listings[path] = set()
+        return self.listings[path]
+
+    def isdir(self, path:str) -> bool:
+        """Checks if a path relative to the root-dir is a directory."""
+        parent, _, name = path.rstrip('/').rpartition('/')
+        if name in ['', '.', '..']:
+            return os.path.isdir(self.root_dir+path)
+        return name in self.listdir(parent)
+
+    def clear(self) -> None:
+        self.listings = {}
+
+
+class NodeSet:
+    """Compact set of nodes in a tree, where each node is stored as a single
+    integer: the mixed-radix number formed by the indices of its directories
+    in each level. Path strings are only rendered when they are iterated
+    over, which keeps very large sweeps from holding one string per node.
+
+    Attributes:
+      levels:      the directories in each level (the same sequences as in
+                   the tree, nothing is copied)
+      suffix:      path that is appended to each node, e.g. a mode dir
+      indices:     array of the mixed-radix index of each node
+
+    Methods:
+      add:         adds a node from its mixed-radix index
+      names:       returns the directory names of a node
+      path:        returns the path of a node
+      max_length:  returns the length of the longest path, without rendering
+                   any of them
+    """
+    def __init__(self, levels:list, suffix:str='', indices:array=None) -> None:
+        self.levels = levels
+        self.suffix = suffix
+        self.indices = array('Q') if indices is None else indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.path(index)
+
+    def add(self, index:int) -> None:
+        self.indices.append(index)
+
+    def names(self, index:int) -> tuple:
+        """Decodes a mixed-radix index into the directory name of each level."""
+        names = []
+        for level in reversed(self.levels):
+            index, i = divmod(index, len(level))
+            names.append(level[i])
+        return tuple(reversed(names))
+
+    def path(self, index:int, suffix:str=None) -> str:
+        """Returns the path of a node, with a different suffix if given."""
+        return '/'+'/'.join(self.names(index))+(self.suffix if suffix is None else suffix)
+
+    def max_length(self) -> int:
+        if len(self.indices) == 0:
+            return 0
+        lengths = [[len(d) for d in level] for level in reversed(self.levels)]
+        longest = 0
+        for index in self.indices:
+            length = 0
+            for level in lengths:
+                index, i = divmod(index, len(level))
+                length += level[i]
+            longest = max(longest, length)
+        return longest+len(self.levels)+len(self.suffix)
+
+
+def shard_owners(key, size:int, count:int, costs:list=None):
+    """Returns the shard (0 to count-1) of each of a number of nodes, which
+    is the same every time (and on every host) given the same nodes.
+
+    Nodes are assigned by a CRC-32 hash of their key, i.e. their path without
+    the suffix, or by cost if given, where the nodes are handed out one at a 
+    time, most costly first, to the shard with the lowest total cost so far.
 
     Keyword arguments:
-      paths:        list of paths to be grafted, if possible
-      graft_point:  point of entry for grafting where the string section 
-                    before the first '/' is part of one of the given paths
+      key:    returns the key of a node from its position
+      size:   the number of nodes
+      count:  the number of shards
+      costs:  expected cost (e.g. duration) of each node
     """
-    grafted_paths = []      
-    entry_point = graft_point[1:].split('/')[0]
-    for path in paths:
-        if (len(graft_point) > 0) and (entry_point in path.split('/')):
-            grafted_path = path.partition(entry_point)[0]+graft_point[1:]
-            if grafted_path not in grafted_paths:
-                grafted_paths.append(grafted_path)
-    
-    return grafted_paths
+    import zlib
+    import heapq
+    if costs is None:
+        return (zlib.crc32(key(j).encode()) % count for j in range(size))
+    order = sorted(range(size), key=lambda j: (-costs[j], key(j)))
+    owners, loads = [0]*size, [(0.0, k) for k in range(count)]
+    for j in order:
+        load, k = heapq.heappop(loads)
+        owners[j] = k
+        heapq.heappush(loads, (load+costs[j], k))
+    return owners
+
 
+def shard_nodes(nodes:NodeSet, shard:int, count:int, costs:list=None) -> NodeSet:
+    """Returns the nodes that belong to one of a number of disjoint shards of
+    a node set (see shard_owners).
 
-def check_files(paths:list, root_dir:str=None, plant_mode=False) -> tuple:
+    Keyword arguments:
+      nodes:  the node set
+      shard:  the shard to return (1 to count)
+      count:  the number of shards
+      costs:  expected cost (e.g. duration) of each node, in the same order
+              as the node set
+    """
+    owners = shard_owners(lambda j: nodes.path(nodes.indices[j], ''), len(nodes), count, costs)
+    return NodeSet(
+        nodes.levels,
+        nodes.suffix,
+        array('Q', (i for i, owner in zip(nodes.indices, owners) if owner == shard-1))
+    )
+
+
+def graft_count(branches:dict, grafted_branches:dict) -> int:
+    """Returns the number of selected leaves below each graft point, i.e.
+    below each run site. This is the same for every run site, since it 
+    counts the selected directories of the levels below it whether or not 
+    they exist, which are never walked.
+
+    Keyword arguments:
+      branches:          the selected directories in each level
+      grafted_branches:  the levels left after grafting (see graft_branches)
+    """
+    return math.prod(len(level) for key, level in branches.items() if key not in grafted_branches)
+
+
+def check_files(paths:list, root_dir:str=None, plant_mode=False, missing:list=None, index:DirIndex=None, ask:bool=True) -> tuple:
     """Given a list of paths, returns the lists of the paths that does, and
     does not, exist on the drive.
 
     Keyword argument:
-      paths:  list of paths
+      paths:    list of paths or a NodeSet (the found paths are returned as
+                a NodeSet as well)
+      missing:  paths already known not to exist (e.g. pruned prefixes), these
+                are reported as not found without being checked again
+      index:    directory index shared between checks (created if not given)
+      ask:      asks whether to continue if some of the paths do not exist
     """
+    if index is None:
+        index = DirIndex(root_dir)
     found, not_found = [], []
+    if missing is not None:
+        not_found.extend(missing)
     
-    # Determine which directories does and does not exist
-    for path in paths:
-        if os.path.isdir(root_dir+path):
-            found.append(path)
-        else:
-            not_found.append(path)
+    # Determine which directories does and does not exist, node sets are 
+    # checked one rendered path at a time and the found nodes kept as indices
+    if type(paths) == NodeSet:
+        found = NodeSet(paths.levels, paths.suffix)
+        for i in paths.indices:
+            path = paths.path(i)
+            if index.isdir(path):
+                found.add(i)
+            else:
+                not_found.append(path)
+    else:
+        for path in paths:
+            if index.isdir(path):
+                found.append(path)
+            else:
+                not_found.append(path)
 
     if plant_mode == False:
         # Make sure user wants to continue if missing files
@@ -58,7 +219,7 @@ def check_files(paths:list, root_dir:str=None, plant_mode=False) -> tuple:
             print('Could not locate the relevant directories.')
             print('\nPlease make sure that the appropriate directories exist and that all modifiers')
             print('in the YAML input (if any) have been supplied.')
-            trm.ExitCode(2)
+            ExitCode(2)
 
         ## Some directories were not found, still continue?
         elif len(not_found) > 0:
@@ -66,13 +227,15 @@ def check_files(paths:list, root_dir:str=None, plant_mode=False) -> tuple:
             for file in not_found:
                 print(file)
 
-            try:
-                q = input('Do you still want to continue (y/[n])? ').lower()
+            # Continued without asking when there is no one to ask
+            if ask:
+                try:
+                    q = input('Do you still want to continue (y/[n])? ').lower()
+                except (EOFError, KeyboardInterrupt):
+                    q = ''
                 if q not in ['y', 'yes']:
                     print('Closing.')
-                    sys.exit()
-            except:
-                trm.ExitCode(0)
+                    ExitCode(0)
 
         # All directories were found
         elif (len(found) == len(paths)) and (len(not_found) == 0):
@@ -91,4 +254,127 @@ def get_paths(paths:dict) -> list:
     """
     prod = itertools.product(*paths.values())
     paths = list(map(lambda e: '/'+'/'.join(e), prod))
-    return paths
\ No newline at end of file
+    return paths
+
+def get_subtree(prefix:str, paths:dict) -> list:
+    """Returns a list of all paths in the subtree below a given prefix path,
+    including the prefix itself, where parents always precede their children.
+
+    Keyword arguments:
+      prefix:  path of a node in the tree, e.g. '/dir1/subdir2', that covers
+               the first levels of the tree
+      paths:   non-nested dictionary with the directories in each level
+    """
+    depth = prefix.count('/')
+    subtree, current = [prefix], [prefix]
+    for level in list(paths.values())[depth:]:
+        current = [f'{p}/{d}' for p in current for d in level]
+        subtree.extend(current)
+    return subtree
+
+
+def plant_paths(paths:list, root_dir:str, jobs:int=1) -> tuple:
+    """Creates directories on the drive and returns the list of created paths
+    and the list of (path, reason) pairs of the paths that could not be 
+    created.
+
+    The paths are sorted so that each parent is created before its children,
+    and a path below one that could not be created is not attempted. Each 
+    top-level branch is planted separately, several at the same time if more
+    than one job is given.
+
+    Keyword arguments:
+      paths:     list of paths, all parents of which either exist or are also
+                 in the list
+      root_dir:  root-dir that contains the tree structure
+      jobs:      maximum number of branches that are planted at the same time
+    """
+    os.makedirs(root_dir, exist_ok=True)
+    branches = {}
+    for path in sorted(paths):
+        branches.setdefault(path.split('/')[1], []).append(path)
+
+    def plant_branch(branch:list) -> tuple:
+        created, failed = [], []
+        for path in branch:
+            if any(path.startswith(f+'/') for f, _ in failed):
+                continue
+            try:
+                os.mkdir(root_dir+path)
+                created.append(path)
+            except FileExistsError:
+                if not os.path.isdir(root_dir+path):
+                    failed.append((path, 'File exists'))
+            except OSError as e:
+                failed.append((path, e.strerror))
+        return created, failed
+
+    if jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            outcomes = list(pool.map(plant_branch, branches.values()))
+    else:
+        outcomes = [plant_branch(branch) for branch in branches.values()]
+
+    created, failed = [], []
+    for c, f in outcomes:
+        created.extend(c)
+        failed.extend(f)
+    return created, failed
+
+
+def graft_branches(branches:dict, graft_point:str) -> dict:
+    """Returns the levels of a tree that are needed to reach a graft point.
+
+    The level that contains the entry point of the graft point is restricted
+    to the entry point, and all levels below it are dropped since they are
+    replaced by the graft. If no level contains the entry point the branches
+    are returned as they are.
+
+    Keyword arguments:
+      branches:     non-nested dictionary with the directories in each level
+      graft_point:  point of entry for grafting, e.g. a mode dir
+    """
+    entry_point = graft_point[1:].split('/')[0]
+    grafted = {}
+    for key, level in branches.items():
+        if (len(graft_point) > 0) and (entry_point in level):
+            grafted[key] = [entry_point]
+            return grafted
+        grafted[key] = level
+    return branches
+
+
+def walk_paths(paths:dict, root_dir:str, index:DirIndex=None) -> tuple:
+    """Descends through a tree one level at a time and returns the leaves 
+    that exist on the drive (as a NodeSet) and the list of missing paths.
+
+    A missing directory drops its whole subtree, which means that missing
+    paths are reported once at the highest missing level instead of once per
+    leaf below it. Paths are only rendered for the levels above the leaves,
+    since those are the ones that have to be listed.
+
+    Keyword arguments:
+      paths:     non-nested dictionary with the directories in each level
+      root_dir:  root-dir that contains the tree structure
+      index:     directory index shared between checks (created if not given)
+    """
+    if index is None:
+        index = DirIndex(root_dir)
+    levels = list(paths.values())
+    found, prefixes, not_found = array('Q', [0]), [''], []
+    for depth, level in enumerate(levels):
+        leaves = (depth == len(levels)-1)
+        next_found, next_prefixes = array('Q'), []
+        for prefix_index, prefix in zip(found, prefixes):
+            # A single listing of the prefix covers all of its children
+            children = index.listdir(prefix)
+            for i, d in enumerate(level):
+                if d in children:
+                    next_found.append(prefix_index*len(level)+i)
+                    if not leaves:
+                        next_prefixes.append(f'{prefix}/{d}')
+                else:
+                    not_found.append(f'{prefix}/{d}')
+        found, prefixes = next_found, next_prefixes
+    return NodeSet(levels, indices=found), not_found
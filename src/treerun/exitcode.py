@@ -0,0 +1,36 @@
+#!/usr/bin/python
+
+"""Exit codes shared by all modules of the program."""
+
+class TreerunError(Exception):
+    """Raised by ExitCode instead of exiting, so that the program can be used
+    as a library. The command line catches it and exits.
+
+    Attributes:
+      exit_code:  the exit code (see ExitCode.legend)
+    """
+    def __init__(self, exit_code:int) -> None:
+        self.exit_code = exit_code
+        super().__init__(f'exit code {exit_code}: {ExitCode.legend.get(exit_code, "")}')
+
+
+class ExitCode:
+    """Exit codes used for graceful shutdowns of the program, which raise a
+    TreerunError with the given code.
+
+    Class attributes:
+      legend:  short description of exit codes
+    """
+    legend = {
+        0:'A problem occurred during input-selection',
+        1:'Missing YAML-input',
+        2:'The necessary files could not be found',
+        3:'Error converting placeholders',
+        4:'Missing mode-command',
+        5:'Log-file does not exist',
+        6:'The journal could not be used',
+    }
+    def __init__(self, exit_code=None,loc=''):
+        self.exit_code = exit_code
+        if self.exit_code != None:
+            raise TreerunError(self.exit_code)
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+import os
+import json
+import fnmatch
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Stores are updated without a lock where files cannot be locked
+    fcntl = None
+
+"""Fingerprints of run directories, used to only run the nodes whose inputs
+or commands have changed since their last successful run."""
+
+def fingerprint(run_dir:str, patterns:list=None, content:bool=False) -> str:
+    """Returns a short digest of the entries in a directory, computed with a
+    single os.scandir pass over it.
+
+    By default the digest covers the name, modification time and size of 
+    each entry, while 'content' also covers the contents of the files.
+
+    Keyword arguments:
+      run_dir:   absolute path of the directory
+      patterns:  glob patterns that the names of the covered entries must 
+                 match (all entries are covered if not given)
+      content:   hash the contents of files instead of their mtime and size
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with os.scandir(run_dir) as entries:
+            entries = sorted(entries, key=lambda e: e.name)
+    except OSError:
+        return ''
+
+    for entry in entries:
+        if patterns and not any(fnmatch.fnmatchcase(entry.name, p) for p in patterns):
+            continue
+        digest.update(entry.name.encode()+b'\0')
+
+        # Symlinks are covered by themselves, not by what they point to, and
+        # entries that vanish while being read are covered by their name
+        try:
+            if content and entry.is_file():
+                with open(entry.path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+            else:
+                stat = entry.stat(follow_symlinks=False)
+                digest.update(f'{stat.st_mtime_ns}:{stat.st_size}\0'.encode())
+        except OSError:
+            continue
+    return digest.hexdigest()
+
+
+def lock_store(store_file:str):
+    """Opens a store of fingerprints for updating, holding an exclusive lock
+    on it. A store that has been replaced by another run while waiting for
+    the lock is opened again.
+    """
+    while True:
+        f = open(store_file, 'a+')
+        if fcntl is None:
+            return f
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_ino == os.stat(store_file).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Files that cannot be locked are updated without a lock
+            return f
+        f.close()
+
+
+class Fingerprints:
+    """Fingerprints of the last successful run of each node of a mode.
+
+    Each node is stored as a single digest of its resolved command and the
+    fingerprint of its run directory once the whole run has finished, so 
+    that the stages of a pipeline that share a run directory all see what
+    the others wrote.
+
+    Attributes:
+      store_file:  file where the fingerprints of all modes are stored
+      mode:        name of the mode that is being run
+      root_dir:    root-dir that contains the tree structure
+      patterns:    glob patterns of the entries covered by the fingerprints
+      content:     whether the contents of files are hashed
+      nodes:       digest of the last successful run of each node
+      changes:     commands of the nodes that finished successfully in this
+                   run (None for the nodes that failed), by node
+
+    Methods:
+      key:         returns the digest of a node in its current state
+      changed:     checks if a node differs from its last successful run
+      started:     does nothing, nodes are fingerprinted on close
+      finished:    notes a node that finished, to be fingerprinted on close
+      refresh:     notes an unchanged node to be fingerprinted again
+      close:       fingerprints the nodes that finished and merges them into
+                   the store file
+    """
+    def __init__(self, store_file:str, mode:str, root_dir:str, settings:dict=None) -> None:
+        if settings is None:
+            settings = {}
+        self.store_file = store_file
+        self.mode = mode
+        self.root_dir = root_dir
+        self.patterns = settings.get('files', None)
+        if type(self.patterns) == str:
+            self.patterns = [self.patterns]
+        self.content = settings.get('content', False)
+        self.lock = threading.Lock()
+
+        try:
+            with open(store_file, 'r') as f:
+                self.store = json.load(f)
+        except (OSError, ValueError):
+            self.store = {}
+        self.nodes = self.store.setdefault(mode, {})
+        self.changes = {}
+
+    def key(self, path:str, cmd:str) -> str:
+        state = fingerprint(self.root_dir+path, self.patterns, self.content)
+        return hashlib.blake2b(f'{cmd}\0{state}'.encode(), digest_size=16).hexdigest()
+
+    def changed(self, path:str, cmd:str) -> bool:
+        return self.nodes.get(path) != self.key(path, cmd)
+
+    def started(self, path:str, cmd:str) -> None:
+        pass
+
+    def finished(self, record:dict) -> None:
+        # Nodes that were never started keep their last successful run
+        if 'reason' in record:
+            return
+        with self.lock:
+            self.changes[record['path']] = record['cmd'] if record['status'] == 0 else None
+
+    def refresh(self, path:str, cmd:str) -> None:
+        with self.lock:
+            self.changes[path] = cmd
+
+    def close(self) -> None:
+        keys = {path:None if cmd is None else self.key(path, cmd) for path, cmd in self.changes.items()}
+
+        # Fingerprints of other modes and nodes may have been written since 
+        # the store was read, e.g. by the other modes of a pipeline or by the
+        # other shards of a run, so only the nodes that ran are updated. The
+        # store is locked while it is updated, so that runs that close at the
+        # same time do not lose each other's updates
+        with lock_store(self.store_file) as store:
+            store.seek(0)
+            try:
+                self.store = json.load(store)
+            except ValueError:
+                self.store = {}
+            nodes = self.store.setdefault(self.mode, {})
+            for path, key in keys.items():
+                if key is None:
+                    nodes.pop(path, None)
+                else:
+                    nodes[path] = key
+            tmp_file = f'{self.store_file}.{os.getpid()}.{threading.get_ident()}'
+            with open(tmp_file, 'w') as f:
+                json.dump(self.store, f, separators=(',', ':'))
+            os.replace(tmp_file, self.store_file)
@@ -0,0 +1,273 @@
+#!/usr/bin/python
+
+import os
+import copy
+import json
+import time
+import datetime
+import threading
+
+"""Append-only journal of the nodes that have been run from a tree, used to
+resume interrupted runs."""
+
+try:
+    import fcntl
+except ImportError:
+    # Journals are never compacted where files cannot be locked
+    fcntl = None
+
+# Journals larger than this (bytes) are compacted after a run
+compact_size = 1 << 22
+
+def journal_path(yaml_file:str, extension:str='journal') -> str:
+    """Returns the path of the journal that belongs to an input file, which
+    is a hidden file next to it, e.g. '.input.yaml.journal'.
+
+    Keyword arguments:
+      yaml_file:  the input file
+      extension:  used for other run state kept next to the input file
+    """
+    head, tail = os.path.split(os.path.abspath(yaml_file))
+    return os.path.join(head, f'.{tail}.{extension}')
+
+
+def completed(journal_file:str, mode:str) -> set:
+    """Returns the set of (path, command) pairs that finished with exit
+    status 0 the last time they were run with a given mode.
+
+    Keyword arguments:
+      journal_file:  path of the journal
+      mode:          name of the mode
+    """
+    done = set()
+    if not os.path.exists(journal_file):
+        return done
+    with open(journal_file, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last line may be cut short by a crash
+                continue
+            if record.get('mode') != mode:
+                continue
+            node = (record['path'], record['cmd'])
+            if (record['event'] == 'finish') and (record['status'] == 0):
+                done.add(node)
+            else:
+                done.discard(node)
+    return done
+
+
+def durations(journal_file:str, mode:str) -> dict:
+    """Returns the duration (s) of the last successful run of each path with
+    a given mode, used to predict how long the nodes of a new run will take.
+
+    Keyword arguments:
+      journal_file:  path of the journal
+      mode:          name of the mode
+    """
+    history = {}
+    if not os.path.exists(journal_file):
+        return history
+    with open(journal_file, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if (record.get('mode') == mode) and (record.get('status') == 0) and ('duration' in record):
+                history[record['path']] = record['duration']
+    return history
+
+
+def compact(journal_file:str, min_size:int=None) -> bool:
+    """Rewrites a journal with only the records that are needed to resume
+    runs and to predict durations, i.e. the last record of each node and
+    command, and the last successful run of each node, of every mode.
+    Returns True if the journal was compacted.
+
+    The journal is only compacted if it is large, if this at least halves it
+    and if no other run is writing to it at the same time (see open_journal).
+
+    Keyword arguments:
+      journal_file:  path of the journal
+      min_size:      size (bytes) below which the journal is left as it is
+    """
+    if min_size is None:
+        min_size = compact_size
+    if fcntl is None:
+        return False
+    try:
+        if os.path.getsize(journal_file) < min_size:
+            return False
+        f = open(journal_file, 'r')
+    except OSError:
+        return False
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        lines = f.readlines()
+        last, last_success = {}, {}
+        for i, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            last[(record.get('mode'), record.get('path'), record.get('cmd'))] = i
+            if (record.get('event') == 'finish') and (record.get('status') == 0) and ('duration' in record):
+                last_success[(record.get('mode'), record.get('path'))] = i
+        kept = sorted(set(last.values()).union(last_success.values()))
+        if 2*len(kept) > len(lines):
+            return False
+
+        tmp_file = f'{journal_file}.{os.getpid()}'
+        try:
+            with open(tmp_file, 'w') as tmp:
+                tmp.writelines(lines[i] for i in kept)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.replace(tmp_file, journal_file)
+        except OSError:
+            return False
+    return True
+
+
+def open_journal(journal_file:str):
+    """Opens a journal for appending, holding a shared lock on it so that it
+    is not compacted while it is being written to. A journal that has been
+    replaced by a compacted one while waiting for the lock is opened again.
+    """
+    while True:
+        f = open(journal_file, 'a')
+        if fcntl is None:
+            return f
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            if os.fstat(f.fileno()).st_ino == os.stat(journal_file).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Files that cannot be locked are written to without a lock
+            return f
+        f.close()
+
+
+class Journal:
+    """Append-only journal that records each node as it starts and finishes.
+
+    Every record is written to the operating system as soon as it is made,
+    so that it survives a crash of the program. Records are synced to the
+    disk in batches so that fast nodes are not slowed down by it.
+
+    Attributes:
+      journal_file:  path of the journal
+      mode:          name of the mode that is being run
+      batch_size:    number of records between syncs to the disk
+      batch_time:    longest time (s) between syncs to the disk
+
+    Methods:
+      started:       records that a node has started
+      finished:      records that a node has finished with its exit status
+      close:         syncs the remaining records and closes the journal
+    """
+    def __init__(self, journal_file:str, mode:str, batch_size:int=64, batch_time:float=1.0) -> None:
+        self.journal_file = journal_file
+        self.mode = mode
+        self.batch_size = batch_size
+        self.batch_time = batch_time
+        self.file = open_journal(journal_file)
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def write(self, record:dict) -> None:
+        with self.lock:
+            self.file.write(json.dumps(record)+'\n')
+            self.file.flush()
+            self.unsynced += 1
+            if (self.unsynced >= self.batch_size) or (time.monotonic()-self.synced_at >= self.batch_time):
+                self.sync()
+
+    def sync(self) -> None:
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def started(self, path:str, cmd:str) -> None:
+        self.write(
+            {
+                'event':'start',
+                'time':datetime.datetime.now().isoformat(),
+                'mode':self.mode,
+                'path':path,
+                'cmd':cmd,
+            }
+        )
+
+    def finished(self, record:dict) -> None:
+        self.write(
+            {
+                'event':'finish',
+                'time':record['end'],
+                'mode':self.mode,
+                'path':record['path'],
+                'cmd':record['cmd'],
+                'status':record['status'],
+                'duration':record['duration'],
+            } | ({'reason':record['reason']} if 'reason' in record else {})
+        )
+
+    def close(self) -> None:
+        with self.lock:
+            if self.unsynced > 0:
+                self.sync()
+            self.file.close()
+
+
+class RunLog:
+    """Machine-readable log in the JSON Lines format with one record per
+    node: path, mode, command, start and end times, duration and exit status.
+
+    Records are written through a buffered writer as the nodes finish, so
+    that the log is produced during the run instead of after it.
+
+    Attributes:
+      log_file:  path of the log
+      mode:      name of the mode that is being run
+
+    Methods:
+      for_mode:  returns a log that shares the file for another mode
+      started:   does nothing, nodes are logged when they finish
+      finished:  writes the record of a finished node
+      close:     flushes the remaining records and closes the log
+    """
+    def __init__(self, log_file:str, mode:str, buffer_size:int=1 << 16) -> None:
+        self.log_file = log_file
+        self.mode = mode
+        self.file = open(log_file, 'a', buffering=buffer_size)
+        self.lock = threading.Lock()
+
+    def for_mode(self, mode:str) -> 'RunLog':
+        """Returns a log that writes to the same file for another mode, e.g.
+        for the other modes of a pipeline.
+        """
+        log = copy.copy(self)
+        log.mode = mode
+        return log
+
+    def started(self, path:str, cmd:str) -> None:
+        pass
+
+    def finished(self, record:dict) -> None:
+        line = json.dumps({'mode':self.mode} | record)+'\n'
+        with self.lock:
+            self.file.write(line)
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
@@ -0,0 +1,355 @@
+#!/usr/bin/python
+
+import os
+import re
+import string
+import fnmatch
+from array import array
+from collections.abc import Sequence
+
+"""Levels of a tree that are defined by a rule instead of a list, e.g. a range
+of seeds or the lines of a file. These are sequences whose directory names
+are computed when they are indexed, so that large levels are never built as
+lists. Also contains the expressions used to select and exclude directories
+of a level."""
+
+# Characters that make a name a glob pattern
+glob_characters = set('*?[')
+
+class RangeLevel(Sequence):
+    """Level with one directory per integer in a range, named by a format
+    string, e.g. 'seed-{:05d}'.
+
+    Names are computed from their index and looked up by parsing the integer
+    back out of them, which means that neither takes time proportional to the
+    size of the level.
+
+    Attributes:
+      range:    the integers of the level
+      fmt:      format string with a single field for the integer
+      pattern:  regex that extracts the integer from a name (None if the
+                format string cannot be inverted)
+    """
+    def __init__(self, start:int=0, stop:int=None, step:int=1, fmt:str='{}') -> None:
+        if stop is None:
+            start, stop = 0, start
+        self.range = range(int(start), int(stop), int(step))
+        self.fmt = fmt
+        self.pattern = None
+        parsed = list(string.Formatter().parse(fmt))
+        fields = [field for _, field, _, _ in parsed if field is not None]
+        if len(fields) == 1:
+            regex, found = '', False
+            for literal, field, _, _ in parsed:
+                regex += re.escape(literal)
+                if (field is not None) and not found:
+                    regex += r'\s*([+-]?\d+)'
+                    found = True
+            self.pattern = re.compile(regex)
+
+    def __len__(self) -> int:
+        return len(self.range)
+
+    def __getitem__(self, i:int or slice) -> str:
+        if type(i) == slice:
+            level = RangeLevel(fmt=self.fmt)
+            level.range, level.pattern = self.range[i], self.pattern
+            return level
+        return self.fmt.format(self.range[i])
+
+    def __contains__(self, name:str) -> bool:
+        try:
+            self.index(name)
+            return True
+        except ValueError:
+            return False
+
+    def index(self, name:str, *args) -> int:
+        if self.pattern is None:
+            return super().index(name, *args)
+        match = self.pattern.fullmatch(str(name))
+        if match is not None:
+            i = int(match.group(1))
+            if (i in self.range) and (self.fmt.format(i) == name):
+                return self.range.index(i)
+        raise ValueError(f'{name} is not in the level')
+
+    def __repr__(self) -> str:
+        return summary(self)
+
+    def __eq__(self, other) -> bool:
+        return (type(other) == RangeLevel) and (self.range, self.fmt) == (other.range, other.fmt)
+
+
+class FileLevel(Sequence):
+    """Level with one directory per line of a text file, where empty lines
+    and lines starting with '#' are skipped.
+
+    The file is read the first time the level is used rather than when the
+    input is loaded, and its contents are never stored in the config cache.
+
+    Attributes:
+      file:   absolute path of the file
+    """
+    def __init__(self, file:str) -> None:
+        self.file = file
+        self._names = None
+        self._lookup = None
+
+    @property
+    def names(self) -> list:
+        if self._names is None:
+            with open(self.file, 'r') as f:
+                lines = (line.strip() for line in f)
+                self._names = [line for line in lines if (line != '') and not line.startswith('#')]
+        return self._names
+
+    def __getstate__(self) -> dict:
+        return dict(file=self.file)
+
+    def __setstate__(self, state:dict) -> None:
+        self.__init__(state['file'])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, i:int or slice) -> str:
+        return self.names[i]
+
+    def __contains__(self, name:str) -> bool:
+        if self._lookup is None:
+            self._lookup = {name:i for i, name in enumerate(self.names)}
+        return name in self._lookup
+
+    def index(self, name:str, *args) -> int:
+        if (len(args) == 0) and (name in self):
+            return self._lookup[name]
+        return self.names.index(name, *args)
+
+    def __repr__(self) -> str:
+        return summary(self)
+
+
+class SubLevel(Sequence):
+    """Selection of the directories of a level, stored as an array of the
+    indices of the selected directories.
+
+    Attributes:
+      level:    the level that the directories are selected from
+      indices:  indices of the selected directories in the level
+    """
+    def __init__(self, level:Sequence, indices:array) -> None:
+        self.level = level
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, i:int or slice) -> str:
+        if type(i) == slice:
+            return SubLevel(self.level, self.indices[i])
+        return self.level[self.indices[i]]
+
+    def __contains__(self, name:str) -> bool:
+        try:
+            self.index(name)
+            return True
+        except ValueError:
+            return False
+
+    def index(self, name:str, *args) -> int:
+        if name in self.level:
+            try:
+                return self.indices.index(self.level.index(name))
+            except ValueError:
+                pass
+        raise ValueError(f'{name} is not in the level')
+
+    def __repr__(self) -> str:
+        return summary(self)
+
+
+def get_level(definition:list or dict, root_dir:str) -> Sequence:
+    """Returns the level of a tree from its definition in the 'Tree' block,
+    which is either a list of directories or a block with one of the keys
+    'range' (with 'start', 'stop', 'step' and 'fmt') or 'from_file'.
+
+    Keyword arguments:
+      definition:  the definition of the level
+      root_dir:    root-dir that relative files are found in
+    """
+    if type(definition) != dict:
+        return definition
+    if 'range' in definition:
+        return RangeLevel(**definition['range'])
+    elif 'from_file' in definition:
+        return FileLevel(os.path.join(root_dir, definition['from_file']))
+    raise KeyError(f'Unknown level definition: {", ".join(definition)}')
+
+
+def compile_patterns(patterns:list) -> re.Pattern:
+    """Compiles glob patterns and regexes (prefixed with 're:') into a single
+    regex that matches whole names (None if there are no patterns).
+    """
+    regexes = []
+    for pattern in patterns:
+        if pattern.startswith('re:'):
+            regexes.append(f'(?:{pattern[3:]})')
+        else:
+            regexes.append(fnmatch.translate(pattern))
+    if len(regexes) == 0:
+        return None
+    return re.compile('|'.join(regexes))
+
+
+class Exclusions:
+    """Names of excluded directories, where names are looked up in a set and
+    glob patterns (e.g. 'seed-000*') and regexes (e.g. 're:seed-\\d*[13]') are
+    compiled into a single regex.
+
+    Attributes:
+      names:    set of excluded names
+      pattern:  compiled regex of all patterns (None if there are none)
+    """
+    def __init__(self, excluded:list=()) -> None:
+        patterns = [e for e in excluded if e.startswith('re:') or glob_characters.intersection(e)]
+        self.names = set(excluded).difference(patterns)
+        self.pattern = compile_patterns(patterns)
+
+    def __contains__(self, name:str) -> bool:
+        if type(name) != str:
+            return False
+        if name in self.names:
+            return True
+        return (self.pattern is not None) and (self.pattern.fullmatch(name) is not None)
+
+    def __len__(self) -> int:
+        return len(self.names)+(self.pattern is not None)
+
+
+class Selector:
+    """Selection of the directories of a level from an expression of comma 
+    separated terms, each of which is one of:
+      3           the third directory (as numbered in the prompt)
+      2-5         the second to fifth directories
+      name        a directory name
+      seed-0*     a glob pattern
+      re:EXPR     a regex, which takes up the rest of the expression
+
+    The expression is compiled once and can then be applied to a level, where
+    index ranges and names are resolved without scanning the level. A list is
+    taken as directory names as they are.
+
+    Attributes:
+      expression:  the expression
+      ranges:      list of (first, last) zero-based indices, inclusive
+      names:       list of directory names
+      pattern:     compiled regex of all patterns (None if there are none)
+
+    Methods:
+      apply:       returns the selected directories of a level
+    """
+    def __init__(self, expression:str or list) -> None:
+        self.expression = expression
+        self.ranges, self.names, patterns = [], [], []
+        if type(expression) != str:
+            self.names, self.pattern = [str(name) for name in expression], None
+            return
+        terms = expression
+        if terms.startswith('re:'):
+            terms, regex = '', terms[3:]
+            patterns.append('re:'+regex)
+        elif ',re:' in terms:
+            terms, regex = terms.split(',re:', 1)
+            patterns.append('re:'+regex)
+        for term in [t.strip() for t in terms.split(',') if t.strip() != '']:
+            first, dash, last = term.partition('-')
+            if first.isdigit() and ((dash == '') or last.isdigit()):
+                first = int(first)
+                last = first if dash == '' else int(last)
+                if (first < 1) or (last < first):
+                    raise ValueError(f'Invalid index range: {term}')
+                self.ranges.append((first-1, last-1))
+            elif glob_characters.intersection(term):
+                patterns.append(term)
+            else:
+                self.names.append(term)
+        try:
+            self.pattern = compile_patterns(patterns)
+        except re.error as e:
+            raise ValueError(f'Invalid regex: {e}')
+
+    def apply(self, level:Sequence) -> Sequence:
+        """Returns the selected directories of a level, in the order of the 
+        level. A single index range is returned as a slice of the level.
+        """
+        if (len(self.ranges) == 1) and (len(self.names) == 0) and (self.pattern is None):
+            first, last = self.ranges[0]
+            return level[first:last+1]
+
+        selected = set()
+        for first, last in self.ranges:
+            selected.update(range(first, min(last+1, len(level))))
+        for name in self.names:
+            if name in level:
+                selected.add(level.index(name))
+        if self.pattern is not None:
+            selected.update(i for i, d in enumerate(level) if self.pattern.fullmatch(str(d)))
+        if type(level) == list:
+            return [level[i] for i in sorted(selected)]
+        return SubLevel(level, array('Q', sorted(selected)))
+
+    def __repr__(self) -> str:
+        return str(self.expression)
+
+
+def parse_selections(selections:list or dict) -> dict:
+    """Returns a dictionary with a compiled Selector for each level, given a
+    list of selections of the form 'LEVEL=EXPR' or a dictionary of levels and
+    their expressions (or lists of names).
+    """
+    if type(selections) == dict:
+        return {level:Selector(expression) for level, expression in selections.items()}
+    selectors = {}
+    for selection in selections:
+        level, equals, expression = selection.partition('=')
+        if equals == '':
+            raise ValueError(f'Selections must be given as LEVEL=EXPR: {selection}')
+        selectors[level.strip()] = Selector(expression)
+    return selectors
+
+
+def exclude(level:Sequence, excluded:Exclusions or list) -> Sequence:
+    """Returns a level without the excluded directories, where levels that
+    are not lists are only filtered if they contain any of them.
+
+    Keyword arguments:
+      level:     the directories of a level
+      excluded:  the excluded directories
+    """
+    if type(excluded) != Exclusions:
+        excluded = Exclusions(excluded)
+    if len(excluded) == 0:
+        return level
+    if type(level) == list:
+        return [d for d in level if d not in excluded]
+
+    # Names are looked up in the level, patterns have to be matched against
+    # every directory of it
+    hits = {level.index(d) for d in excluded.names if d in level}
+    if excluded.pattern is not None:
+        hits.update(i for i, d in enumerate(level) if excluded.pattern.fullmatch(str(d)))
+    if len(hits) == 0:
+        return level
+    return SubLevel(level, array('Q', (i for i in range(len(level)) if i not in hits)))
+
+
+def summary(level:Sequence, shown:int=3) -> str:
+    """Returns a short description of a level, listing its first and last
+    directories only if it is long.
+    """
+    if len(level) <= 2*shown:
+        return repr(list(level))
+    head = ', '.join(repr(level[i]) for i in range(shown))
+    tail = ', '.join(repr(level[i]) for i in range(len(level)-shown, len(level)))
+    return f'[{head}, ..., {tail}] ({len(level)} directories)'
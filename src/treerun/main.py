@@ -2,106 +2,264 @@
 
 import os
 import sys
-import yaml
-import copy
+import time
 import datetime
-import subprocess
-import itertools
 import functools
-from importlib.metadata import version
-import argparse
+import itertools
+import threading
+import contextlib
 
 from treerun import broadcast
 from treerun import dirutils
 from treerun import YAMLutils
+from treerun import runner
+from treerun import batch
+from treerun import journal
+from treerun import fingerprint
+from treerun import levels
+from treerun import plan
+from treerun.exitcode import ExitCode, TreerunError
 from treerun.parser import argument_parser, example_tree
 
-args = argument_parser()
+
+def shard_name(file:str, shard:tuple) -> str:
+    """Returns the name of a log file of one shard of a run, e.g. 
+    'run.shard-2-of-4.log' for 'run.log'.
+    """
+    base, extension = os.path.splitext(file)
+    return f'{base}.shard-{shard[0]}-of-{shard[1]}{extension}'
 
 
-class ExitCode:
-    """Exit codes used for graceful shutdowns of the program.
+class Result:
+    """Outcome of running a mode at the nodes of a tree.
 
-    Class attributes:
-      legend:  short description of exit codes
+    Attributes:
+      mode:          name of the mode (modes of a pipeline joined by '->')
+      records:       records of all runs (see runner.run_node)
+      found:         paths of the nodes that were found on the disk (a
+                     NodeSet when the tree was walked)
+      not_found:     paths of the nodes that were not found on the disk
+      successful:    paths of runs that exited with status 0 (or that were
+                     submitted to a batch scheduler)
+      unsuccessful:  paths of runs that failed or could not be started
+      ok:            whether all runs were successful
     """
-    legend = {
-        0:'A problem occurred during input-selection',
-        1:'Missing YAML-input',
-        2:'The necessary files could not be found',
-        3:'Error converting placeholders',
-        4:'Missing mode-command',
-        5:'Log-file does not exist',
-    }
-    def __init__(self, exit_code=None,loc=''):
-        self.exit_code = exit_code
-        if self.exit_code != None:
-            print(f'exit code: {self.exit_code}')
-            sys.exit()
+    def __init__(self, mode:str, records:list, found:list, not_found:list) -> None:
+        self.mode = mode
+        self.records = records
+        self.found = found
+        self.not_found = not_found
+
+    @property
+    def successful(self) -> list:
+        return [r['path'] for r in self.records if not runner.failed(r)]
+
+    @property
+    def unsuccessful(self) -> list:
+        return [r['path'] for r in self.records if runner.failed(r)]
+
+    @property
+    def ok(self) -> bool:
+        return not any(runner.failed(r) for r in self.records)
+
+    def __repr__(self) -> str:
+        return f'Result(mode={self.mode!r}, successful={len(self.successful)}, unsuccessful={len(self.unsuccessful)}, not_found={len(self.not_found)})'
 
 
 class Tree:
     """A class used to run shell commands from different locations on the disk.
 
+    The tree can also be used as a library, where the input is given as a 
+    path or as a dictionary, the levels and the mode are given as arguments
+    and errors are raised as TreerunError instead of exiting:
+      tree = Tree({'Tree':..., 'Modes':...}, selections={'Seed':'1-10'}, interactive=False)
+      result = tree.climb(mode='Mode 1')
+
     Attributes:
       yaml_data:         contains the full contents of the input YAML file
+      yaml_file:         the input file, which run state is kept next to (None
+                         to keep no run state)
+      interactive:       prompt for selections and confirmations, otherwise
+                         levels without a selection are selected in full
       modifier:          replaces {mod} in the YAML file
-      excluded:          nodes that are being excluded from selection
+      excluded:          nodes that are being excluded from selection (names,
+                         glob patterns or regexes, see levels.Exclusions)
+      selectors:         compiled selections of the levels that are selected
+                         without a prompt (see levels.Selector)
       select_all:        select all nodes of the tree
       log_file:          name of log file
+      json_log:          name of JSON Lines log file (one record per node)
+      top:               number of slowest/most memory-hungry nodes reported
+      capture:           dir of the log tree that the output of each node is
+                         captured in ('' for the run dirs, None to not capture)
+      tail:              number of captured lines shown per node
+      jobs:              maximum number of nodes that are run at the same time
+      resume:            skip nodes that completed in a previous run
+      changed_only:      only run nodes that changed since their last success
+      adaptive:          adapt the number of nodes that run at the same time
+                         to the load and the available memory
       tree:              tree-structure defined in the input
       modes:             run-modes defined in the input
       root_dir:          root-dir that contains the tree structure
-      succesful:         paths of succesful runs
-      unsuccesful:       paths of unsuccesful runs
+      index:             cached listings of the directories in the tree
+      placeholder_map:   values of the placeholders/handles in the input
+      abort_rate:        fraction of failed nodes at which a run is stopped
+      shard:             (shard, number of shards) of the nodes that are run
+      shard_by:          'hash' or 'history' (balanced by past durations)
+      plan_file:         where the plan of a run is written instead of running
+                         it (see plan.write)
+      from_plan:         contents of a precomputed plan that is run instead of
+                         the input (see plan.read)
+      stop:              stops a run when it is set, e.g. from another thread
+      records:           records of all runs (see runner.run_node)
+      succesful:         paths of runs that exited with status 0
+      unsuccesful:       paths of runs that failed or could not be started
 
     Methods:
-      plant:             not yet implemented
+      normalize:         resolves the root-dir, placeholders and modes
+      plant:             creates the missing directories of the tree
       selection_prompt:  prompts the user to select a node or a run-mode
       select:            used to select nodes and modes during operation
+      get_command:       returns the command of a mode
+      get_words:         returns the command of a mode split into words
+      get_node:          returns the paths and commands of a node
       logger:            logs the outcome to a file
+      run_state:         returns the path of a file of run state
+      read_journal:      reads the previous runs of a mode from the journal
+      predict:           returns the expected duration of each node of a run
       climb:             runs the selected mode at the selected nodes
+      execute:           runs the resolved commands of the nodes
+      climb_async:       awaitable version of climb
     """
-    def __init__(self, yaml_data:str, modifier:str, excluded:list, select_all:bool, log_file:str) -> None:
-        if yaml_data is None: self.plant
-        else: self.yaml_data = YAMLutils.load_input(yaml_data)
+    # Levels with more than twice this many options are shown in part
+    page_size = 10
+
+    def __init__(self, yaml_data:str or dict, modifier:str=None, excluded:list=None, select_all:bool=False, log_file:str=None, jobs:int=1, use_cache:bool=True, resume:bool=False, changed_only:bool=False, json_log:str=None, top:int=5, capture:str=None, tail:int=0, selections:list or dict=None, adaptive:bool=False, abort_rate:float=None, shard:tuple=None, shard_by:str='hash', interactive:bool=True, plan_file:str=None, from_plan:str=None, state_file:str=None) -> None:
+        self.yaml_file = yaml_data
         self.modifier = modifier
-        self.excluded = excluded
+        try:
+            self.excluded = levels.Exclusions(excluded or [])
+            self.selectors = levels.parse_selections(selections or [])
+        except ValueError as e:
+            print(e)
+            ExitCode(0)
         self.select_all = select_all
         self.log_file = log_file
+        self.json_log = json_log
+        self.top = top
+        self.capture = capture
+        self.tail = tail
+        self.jobs = jobs
+        self.resume = resume
+        self.changed_only = changed_only
+        self.adaptive = adaptive
+        self.abort_rate = abort_rate
+        self.shard = shard
+        self.shard_by = shard_by
+        self.interactive = interactive
+        self.stop = threading.Event()
+        self.plan_file = plan_file
+        self.from_plan = None
 
+        # Precomputed plans hold everything that is needed to run them
+        if from_plan is not None:
+            try:
+                self.from_plan = plan.read(from_plan)
+            except (OSError, ValueError) as e:
+                print(e)
+                ExitCode(1)
+            self.yaml_file = self.from_plan['input']
+            config = dict(
+                root_dir=self.from_plan['root_dir'],
+                placeholder_map=self.from_plan['placeholders'],
+                tree={},
+                modes={},
+            )
+
+        # The normalized config depends on the modifier and the working dir.
+        # Inputs that are given as dictionaries are not cached, and their run
+        # state is only kept if they are given the name of an input file
+        elif yaml_data is None: self.plant
+        elif type(yaml_data) == dict:
+            self.yaml_data, config = yaml_data, self.normalize(yaml_data)
+            self.yaml_file = state_file
+        else: self.yaml_data, config = YAMLutils.load_cached(
+            yaml_data,
+            self.normalize,
+            key=(self.modifier, os.getcwd()),
+            use_cache=use_cache,
+        )
+        self.root_dir = config['root_dir']
+        self.placeholder_map = config['placeholder_map']
+        self.tree = config['tree']
+        self.modes = config['modes']
+        self.records = []
+
+        # Directories on disk are listed at most once per run
+        self.index = dirutils.DirIndex(self.root_dir)
+
+    @property
+    def successful(self) -> list:
+        return [r['path'] for r in self.records if not runner.failed(r)]
+
+    @property
+    def unsuccessful(self) -> list:
+        return [r['path'] for r in self.records if runner.failed(r)]
+
+    def normalize(self, yaml_data:dict) -> dict:
+        """Resolves the root-dir, the placeholders and the modes of the 
+        contents of an input YAML file.
+
+        Keyword arguments:
+          yaml_data:  contents of the input YAML file
+        """
         # 'Root: dir' specifies where the tree is. Default is same dir as YAML
-        if 'Root' in self.yaml_data: 
-            self.root_dir = os.path.abspath(self.yaml_data['Root'])
-        else: self.root_dir = os.getcwd()
+        if 'Root' in yaml_data: 
+            root_dir = os.path.abspath(yaml_data['Root'])
+        else: root_dir = os.getcwd()
 
         # Convert placeholders to variables
         ## Default if not in yaml
-        self.placeholder_map = dict(
+        placeholder_map = dict(
             mod=self.modifier,
-            root=self.root_dir,
+            root=root_dir,
         )
         ## Defined in input.yaml
-        if 'Handles' in self.yaml_data:
-            self.placeholder_map = self.yaml_data['Handles'] | self.placeholder_map
-        elif 'Placeholders' in self.yaml_data:
-            self.placeholder_map = self.yaml_data['Placeholders'] | self.placeholder_map
+        if 'Handles' in yaml_data:
+            placeholder_map = yaml_data['Handles'] | placeholder_map
+        elif 'Placeholders' in yaml_data:
+            placeholder_map = yaml_data['Placeholders'] | placeholder_map
         
         # Make sure that cli input overrides anything in config
         if self.modifier is not None:
-            self.placeholder_map['mod'] = self.modifier
+            placeholder_map['mod'] = self.modifier
 
         # Define tree and mode options
-        self.tree = self.yaml_data['Tree']
-        self.modes = YAMLutils.convert_handles(self.yaml_data['Modes'], self.placeholder_map)
-        self.successful, self.unsuccessful = [],[]
+        return dict(
+            root_dir=root_dir,
+            placeholder_map=placeholder_map,
+            tree={
+                key:levels.get_level(level, root_dir) 
+                for key, level in yaml_data['Tree'].items()
+            },
+            modes=YAMLutils.convert_handles(yaml_data['Modes'], placeholder_map),
+        )
 
-    def plant(self):
+    def plant(self, dry_run:bool=False):
         """Checks if the directories listed in the input file exists. If not, 
         allows the user to plant the missing parts of the tree.
+
+        Keyword arguments:
+          dry_run:  only report what would be planted, without creating 
+                    anything
         """
-        paths = dirutils.get_paths(self.tree)
-        found, not_found = dirutils.check_files(paths, self.root_dir, plant_mode=True)
+        start = time.perf_counter()
+        found, not_found = dirutils.walk_paths(self.tree, self.root_dir, index=self.index)
+
+        # Missing prefixes are planted together with their subtrees
+        paths = []
+        for prefix in not_found:
+            paths.extend(dirutils.get_subtree(prefix, self.tree))
 
         # Show not found dirs and decide if they should be created
         broadcast.header('Planting tree:')
@@ -109,23 +267,39 @@ class Tree:
             print('\nUnable to find the following directories:')
             for f in not_found:
                 print(f)
-            
-            q = input('\nWould you like to create the missing directories (y/[n])? ').lower()
-            if q not in ['y', 'yes']:
-                print('Closing.')
-                sys.exit()
-            else:
-                # Planting tree
-                for path in not_found:
-                    try:
-                        subprocess.run(f'mkdir -p {self.root_dir+path}', shell=True)
-                        print(f'Created: {path}')
-                    except:
-                        print(f'Could not create: {path}')
-                print('Done!')
         else:
             print('Tree already exists.')
 
+        if dry_run or len(not_found) == 0:
+            print()
+            broadcast.tabulate(
+                {
+                    'Existing leaves:':len(found),
+                    'Missing subtrees:':len(not_found),
+                    'Directories to create:':len(paths),
+                    'Time:':f'{time.perf_counter()-start:.3f} s',
+                }
+            )
+            return
+
+        q = input('\nWould you like to create the missing directories (y/[n])? ').lower() if self.interactive else 'y'
+        if q not in ['y', 'yes']:
+            print('Closing.')
+            return
+
+        # Planting tree
+        start = time.perf_counter()
+        created, failed = dirutils.plant_paths(
+            paths,
+            self.root_dir,
+            jobs=runner.get_jobs(self.jobs)
+        )
+        self.index.clear()
+        for path, reason in failed:
+            print(f'Could not create: {path} ({reason})')
+        print(f'Created {len(created)} directories in {time.perf_counter()-start:.3f} s')
+        print('Done!')
+
 
     def selection_prompt(self, description:str, options:dict or list, select_all:bool) -> list:
         """Promts the user to give an enter an input in the form of an integer 
@@ -138,7 +312,7 @@ class Tree:
           select_all:   boolean that automatically selects all options
         """
         if select_all:
-            selection = [opt for opt in options if opt not in self.excluded]
+            selection = levels.exclude(options, self.excluded)
         else:            
             while True:
                 # Attempt selection
@@ -156,7 +330,7 @@ class Tree:
 
                     ## Make sure index is valid
                     if 1 <= index_selection < len(options)+1:
-                        if type(options) == list:
+                        if type(options) != dict:
                             # Shift of -1 needed for list since prompt starts from 1
                             selection = options[index_selection-1]
                         
@@ -176,12 +350,27 @@ class Tree:
                 # If selection is not digit, select all using '*' or simply 'enter'
                 elif (index_selection in ['', '*']) and (type(options) != dict):
                     # Filter all excluded if multiple selections
-                    selection = [s for s in options if s not in self.excluded]
+                    selection = levels.exclude(options, self.excluded)
                     break
+                # Several modes are run as a pipeline in the given order
                 elif type(options) == dict:
-                    print('Only one mode at a time can be selected.')
+                    indices = index_selection.replace(' ', '').split(',')
+                    if all(i.isdigit() and (1 <= int(i) <= len(options)) for i in indices):
+                        selection = [options[int(i)] for i in indices]
+                        break
+                    print('Enter an integer, or several separated by commas to run them as a pipeline.')
+
+                # Anything else is a selection expression, e.g. '2-5,seed-1*'
                 else:
-                    print('Enter an integer or press enter to select all.')
+                    try:
+                        selection = levels.Selector(index_selection).apply(options)
+                    except ValueError as e:
+                        print(e)
+                        continue
+                    selection = levels.exclude(selection, self.excluded)
+                    if len(selection) > 0:
+                        break
+                    print('No non-excluded options match the selection.')
                 continue
 
         return selection
@@ -199,22 +388,51 @@ class Tree:
         
         # Select branches
         if selection_type == 'branches':
+            unknown = [key for key in self.selectors if key not in self.tree]
+            if len(unknown) > 0:
+                print(f'Unknown levels in selection: {", ".join(unknown)}')
+                print(f'Levels: {", ".join(self.tree)}')
+                ExitCode(0)
+
             for key, level in self.tree.items():
                 broadcast.header(key)
 
-                # Show options available for selection
-                for i, option in enumerate(level):
-                    if option in self.excluded:
-                        print(f'({i+1}) {option} (excluded)')
+                # Levels given on the command line are selected without a 
+                # prompt
+                if key in self.selectors:
+                    selection = levels.exclude(self.selectors[key].apply(level), self.excluded)
+                    print(f'Selected {len(selection)} of {len(level)} ({self.selectors[key]})')
+                    if len(selection) == 0:
+                        print('No non-excluded options match the selection.')
+                        ExitCode(0)
+                    branches[key] = selection
+                    continue
+
+                # Show options available for selection, only the first and
+                # last ones of large levels
+                shown = range(len(level))
+                if len(level) > 2*self.page_size:
+                    shown = itertools.chain(
+                        range(self.page_size),
+                        [None],
+                        range(len(level)-self.page_size, len(level))
+                    )
+                for i in shown:
+                    if i is None:
+                        print(f'... ({len(level)-2*self.page_size} more)')
+                    elif level[i] in self.excluded:
+                        print(f'({i+1}) {level[i]} (excluded)')
                     else:
-                        print(f'({i+1}) {option}')
+                        print(f'({i+1}) {level[i]}')
 
                 # Make selection
                 desc = 'Enter an integer to select an option (press enter to select all): '
+                if len(level) > 2*self.page_size:
+                    desc = 'Enter an integer, a range (e.g. 2-5), a glob or re:REGEX (press enter to select all): '
                 selection = self.selection_prompt(
                     desc,
                     level,
-                    select_all=self.select_all
+                    select_all=self.select_all or not self.interactive
                 )
 
                 # Selection must be a list (preparation for cartiesian product)
@@ -239,11 +457,154 @@ class Tree:
             return mode
 
 
+    def get_pipeline(self, selection:tuple or list) -> list:
+        """Returns the (name, parameters) of each mode that is run at every 
+        node, in order, given the selected mode(s). Modes with a 'pipeline'
+        option are replaced by the modes listed in it.
+
+        Keyword arguments:
+          selection:  a selected (name, parameters) pair or a list of them
+        """
+        if type(selection) != list:
+            selection = [selection]
+        stages = []
+        for mode, mode_params in selection:
+            if 'pipeline' not in mode_params:
+                stages.append((mode, mode_params))
+                continue
+            for stage in mode_params['pipeline']:
+                if (stage not in self.modes) or ('pipeline' in self.modes[stage]):
+                    print(f'The pipeline of {mode} refers to an unknown mode: {stage}')
+                    ExitCode(4)
+                stages.append((stage, self.modes[stage]))
+        return stages
+
+
+    def get_stage(self, mode:str, mode_params:dict) -> dict:
+        """Returns everything that is needed to run a mode at the nodes of the
+        tree: its command (for display), the compiled templates of its command,
+        whether it needs a shell, its run dir and its job array settings.
+
+        Keyword arguments:
+          mode:         name of the mode
+          mode_params:  the definition of the mode, with converted handles
+        """
+        # Placeholders are resolved from the level names and the handles. The
+        # template is compiled from the unconverted mode so that escaped
+        # braces are kept, and unknown placeholders are caught before any
+        # node is run
+        level_names = list(self.tree.keys())
+        template = YAMLutils.Template(
+            self.get_command(self.yaml_data['Modes'][mode])
+        )
+        unknown = template.missing(level_names+list(self.placeholder_map))
+        if len(unknown) > 0:
+            print(f'Unknown placeholders in command: {", ".join(unknown)}')
+            print(f'Placeholders must be a level name or a handle: {", ".join(level_names+list(self.placeholder_map))}')
+            ExitCode(3)
+        template = template.bind(self.placeholder_map)
+
+        # Commands without shell features (or modes with 'shell: false') are 
+        # executed directly from a list of arguments that is split only once
+        shell = mode_params.get('shell', None)
+        try:
+            words = [
+                YAMLutils.Template(word)
+                for word in self.get_words(self.yaml_data['Modes'][mode])
+            ]
+        except ValueError:
+            # Placeholders that were split up, e.g. by quotes
+            words, shell = [], True
+        argv = [word.bind(self.placeholder_map) for word in words]
+
+        # A shell splits the values of placeholders into words again, which
+        # is only known not to matter for handles without whitespace. Level
+        # names are only filled in at each node, so 'shell: false' is needed
+        # to run commands with level placeholders directly
+        if shell is None:
+            shell = runner.needs_shell([word.text() for word in argv]) or any(
+                (len(word.fields) > 0) and ((len(bound.fields) > 0) or any(c.isspace() for c in bound.text()))
+                for word, bound in zip(words, argv)
+            )
+
+        # Modes with an 'array' option are submitted as a single job array
+        array = None
+        if 'array' in mode_params:
+            array = batch.get_settings(self.yaml_data['Modes'][mode]['array'])
+            unknown = YAMLutils.Template(array['submit']).missing(
+                list(self.placeholder_map)+batch.submit_handles
+            )
+            if len(unknown) > 0:
+                print(f'Unknown placeholders in array submit command: {", ".join(unknown)}')
+                ExitCode(3)
+
+        # Get sub-dir to run in, if specified
+        if 'dir' in mode_params:
+            run_dir = '/'+mode_params['dir']
+        elif 'directory' in mode_params:
+            run_dir = '/'+mode_params['directory']
+        else:
+            run_dir = ''
+
+        return dict(
+            mode=mode,
+            params=mode_params,
+            cmd=self.get_command(mode_params),
+            template=template,
+            argv=argv,
+            shell=shell,
+            array=array,
+            run_dir=run_dir,
+        )
+
+
+    def get_command(self, mode_params:dict) -> str:
+        """Returns the command of a mode, including its arguments if any.
+
+        Keyword arguments:
+          mode_params:  the definition of a mode in the 'Modes' block
+        """
+        # Collect arguments form list, if specified
+        if 'args' in mode_params:
+            cmd_args = ' '+' '.join(mode_params['args'])
+        elif 'arguments' in mode_params:
+            cmd_args = ' '+' '.join(mode_params['arguments'])
+        else:
+            cmd_args = ''
+
+        # Get command
+        if 'cmd' in mode_params:
+            cmd = mode_params['cmd']+cmd_args
+        elif 'command' in mode_params:
+            cmd = mode_params['command']+cmd_args
+        else:
+            ExitCode(4)
+            raise KeyError('The selected mode has no command.')
+        return cmd
+
+
+    def get_words(self, mode_params:dict) -> list:
+        """Returns the command of a mode, including its arguments if any, 
+        split into words the way a shell would split it. Commands that cannot
+        be split (e.g. with unbalanced quotes) are returned as a single word.
+
+        Keyword arguments:
+          mode_params:  the definition of a mode in the 'Modes' block
+        """
+        import shlex
+        cmd = self.get_command(mode_params)
+        try:
+            return shlex.split(cmd)
+        except ValueError:
+            return [cmd]
+
+
     def logger(self, log_file, mode, cmd, max_length, found, not_found):
         """Stores the outcome of a run into a log file.
 
         This method is somewhat clumsy but its purpose is to remove clutter from
-        the climb-method.
+        the climb-method. The outcome of each node is taken from the records
+        of the run.
 
         Keyword arguments:
           log_file:    the name of the log file
@@ -254,7 +615,7 @@ class Tree:
           not_found:   all paths that were not found on the disk
         """
         try:
-            with open(f'{self.root_dir}/{log_file}', 'a') as sys.stdout:
+            with open(f'{self.root_dir}/{log_file}', 'a') as f, contextlib.redirect_stdout(f):
                 broadcast.horizontal_line()
                 broadcast.tabulate(
                     {
@@ -265,12 +626,22 @@ class Tree:
                 )
                 print()
                 print('Successfully submitted:')
-                broadcast.tabulate({p:cmd for p in self.successful}, max_length)
+                for r in self.records:
+                    if not runner.failed(r):
+                        broadcast.tabulate({r['path']:r['cmd']}, max_length)
 
-                if len(self.unsuccessful) > 0:
+                if any(runner.failed(r) for r in self.records):
                     print()
                     print('Unsuccessful submissions:')
-                    broadcast.tabulate({p:cmd for p in self.unsuccessful}, max_length)
+                    for r in self.records:
+                        if runner.failed(r):
+                            broadcast.tabulate(
+                                {r['path']:r['cmd']+(
+                                    f'    (exit status {r["status"]})' if r['status'] is not None else
+                                    f'    ({r["reason"]})' if 'reason' in r else ''
+                                )},
+                                max_length
+                            )
 
                 if len(not_found) > 0:
                     print()
@@ -280,109 +651,457 @@ class Tree:
             ExitCode(5)
 
 
-    def climb(self) -> None:
-        """Goes through the tree and runs the selected mode (command) at all the
-        selected nodes/leaves/branches.
+    def run_state(self, extension:str='journal') -> str:
+        """Returns the path of a file of run state (see journal.journal_path),
+        or None if no run state is kept.
         """
-        # Obtain modes and branches to run from
-        branches = self.select('branches')
-        selected_mode, mode_params = self.select('mode')
+        if self.yaml_file is None:
+            return None
+        return journal.journal_path(self.yaml_file, extension)
 
-        # Collect arguments form list, if specified
-        if 'args' in mode_params:
-            cmd_args = ' '+' '.join(mode_params['args'])
-        elif 'arguments' in mode_params:
-            cmd_args = ' '+' '.join(mode_params['arguments'])
-        else:
-            cmd_args = ''
 
-        # Get command
-        if 'cmd' in mode_params:
-            cmd = mode_params['cmd']+cmd_args
-        elif 'command' in mode_params:
-            cmd = mode_params['command']+cmd_args
-        else:
-            ExitCode(4)
-            raise KeyError('The selected mode has no command.')
+    def read_journal(self, read, mode:str, feature:str=None) -> set or dict:
+        """Returns what a function of the journal module (e.g. completed or 
+        durations) reads about the previous runs of a mode. Features that 
+        rely on the journal stop the run if it cannot be read, while others
+        do without it.
 
-        # Get sub-dir to run in, if specified
-        if 'dir' in mode_params:
-            run_dir = '/'+mode_params['dir']
-        elif 'directory' in mode_params:
-            run_dir = '/'+mode_params['directory']
+        Keyword arguments:
+          read:     the function that reads the journal
+          mode:     name of the mode
+          feature:  name of the feature that relies on the journal (None if
+                    it is optional)
+        """
+        journal_file = self.run_state()
+        try:
+            if journal_file is None:
+                raise OSError('no journal is kept for inputs given as dictionaries without a state_file')
+            return read(journal_file, mode)
+        except OSError as e:
+            if feature is not None:
+                print(f'{feature} needs the journal, which could not be read: {e}')
+                ExitCode(6)
+            return {}
+
+
+    async def climb_async(self, mode:str or list=None) -> Result:
+        """Awaitable version of climb, which runs in a worker thread so that
+        the event loop of the caller is never blocked while the nodes run.
+        Cancelling it stops the run, where the running nodes are killed and
+        the cancellation is raised once the run has been wound up.
+        """
+        import asyncio
+        run = asyncio.ensure_future(asyncio.to_thread(self.climb, mode))
+        try:
+            return await asyncio.shield(run)
+        except asyncio.CancelledError:
+            self.stop.set()
+            await asyncio.wait([run])
+            self.stop.clear()
+            raise
+
+
+    def climb(self, mode:str or list=None) -> Result:
+        """Goes through the tree and runs the selected mode (command) at all the
+        selected nodes/leaves/branches, and returns the outcome. Several modes
+        are run as a pipeline, where each node runs the next mode as soon as 
+        its previous one has completed successfully, independently of the 
+        other nodes.
+
+        Keyword arguments:
+          mode:  name of the mode, or a list of names for a pipeline, that is
+                 run instead of prompting for it
+        """
+        # Precomputed plans are run as they are, without selecting anything
+        if self.from_plan is not None:
+            return self.replay()
+
+        # Obtain modes and branches to run from
+        branches = self.select('branches')
+        if mode is None:
+            if not self.interactive:
+                print('A mode must be given when not prompting for one.')
+                ExitCode(0)
+            selection = self.select('mode')
         else:
-            run_dir = ''
+            names = [mode] if type(mode) == str else mode
+            unknown = [name for name in names if name not in self.modes]
+            if len(unknown) > 0:
+                print(f'Unknown modes: {", ".join(unknown)}')
+                ExitCode(0)
+            selection = [(name, self.modes[name]) for name in names]
+        stages = [self.get_stage(*stage) for stage in self.get_pipeline(selection)]
+        selected_mode = ' -> '.join(stage['mode'] for stage in stages)
+        pipeline = len(stages) > 1
+        if pipeline and any(stage['array'] is not None for stage in stages):
+            print('Modes that are submitted as job arrays cannot be part of a pipeline.')
+            ExitCode(0)
+        cmd = ' && '.join(stage['cmd'] for stage in stages)
+        run_dir = stages[0]['run_dir']
 
         broadcast.header('Summary:')
-        tmp = {
-            'Mode:':selected_mode,
-            'Command:':cmd,
-        }
+        tmp = {'Mode:':selected_mode}
+        if pipeline:
+            for k, stage in enumerate(stages):
+                tmp[f'Stage {k+1}:'] = f'{stage["cmd"]}'+(f' (in {stage["run_dir"][1:]})' if stage['run_dir'] != '' else '')
+        else:
+            tmp['Command:'] = cmd
         if self.modifier is not None:
             tmp['Modifier:'] = self.modifier
-        if run_dir != '':
+        if (run_dir != '') and not pipeline:
             tmp['Run directory:'] = run_dir
+
+        # Only levels above the graft point (if any) of the specified run_dir
+        # need to be checked, all leaves below it share the same run site. All
+        # stages of a pipeline must share the same run sites
+        grafted = [dirutils.graft_branches(branches, stage['run_dir']) for stage in stages]
+        if any(g != grafted[0] for g in grafted[1:]):
+            print('All modes of a pipeline must run at the same level of the tree.')
+            ExitCode(0)
+        grafted_branches = grafted[0]
+        if grafted_branches is not branches:
+            tmp['Selected leaves per run site:'] = dirutils.graft_count(branches, grafted_branches)
         broadcast.tabulate(tmp|branches)
         
-        # Attempts pruning of paths if the specified run_dir has a lower level than 
-        # the maximum
-        paths = dirutils.get_paths(branches)
-        pruned_paths = dirutils.graft_paths(paths, run_dir)
-
-        # Get paths and make find out which actually exist
-        if len(pruned_paths) == 0:
-            paths = [p+run_dir for p in paths]
-            found, not_found = dirutils.check_files(paths, self.root_dir)
-        else:
-            paths = [p for p in pruned_paths]
-            found, not_found = dirutils.check_files(pruned_paths, self.root_dir)
+        # Descends the selected levels one at a time, missing directories are
+        # pruned together with their subtrees. The leaves are kept as indices
+        # and the run dir is appended when their paths are rendered, where a
+        # grafted run dir replaces the directory of its entry point
+        paths, missing = dirutils.walk_paths(grafted_branches, self.root_dir, index=self.index)
+        for stage in stages:
+            stage['suffix'] = stage['run_dir']
+            if grafted_branches is not branches:
+                stage['suffix'] = stage['run_dir'][len(stage['run_dir'][1:].split('/')[0])+1:]
+        paths.suffix = stages[0]['suffix']
+
+        # Only one shard of the nodes is run, e.g. one per host
+        log_file, json_log, plan_file = self.log_file, self.json_log, self.plan_file
+        if self.shard is not None:
+            shard, count = self.shard
+            costs = None
+            if self.shard_by == 'history':
+                costs = self.predict(
+                    stages,
+                    lambda k: (paths.path(i, stages[k]['suffix']) for i in paths.indices),
+                    '--shard-by history'
+                )
+            total = len(paths)
+            paths = dirutils.shard_nodes(paths, shard, count, costs)
+            print(f'Shard {shard} of {count}: {len(paths)} of {total} nodes'+(' (balanced by history)' if costs is not None else ''))
+            if len(paths) == 0:
+                print('Closing.')
+                return Result(selected_mode, [], [], [])
+            log_file = None if log_file is None else shard_name(log_file, self.shard)
+            json_log = None if json_log is None else shard_name(json_log, self.shard)
+            plan_file = None if plan_file is None else shard_name(plan_file, self.shard)
+
+        # Find out which paths actually exist, the run dirs of later stages
+        # may be created by the earlier ones
+        found, not_found = dirutils.check_files(paths, self.root_dir, missing=missing, index=self.index, ask=self.interactive)
 
         # RUN
-        # Attempt to submit all files that were found
+        # Attempt to submit all files that were found, where the commands of
+        # a node are only resolved when the node is about to run
         broadcast.header(f'Submitting:')
-        for path in found:
-            tmp_cmd = copy.deepcopy(cmd)
+        tasks = runner.Tasks(len(found), len(stages), functools.partial(self.get_node, found, stages))
 
-            # Convert possible 'level' placeholders in commands
+        # The resolved nodes are written to a plan instead of being run
+        if plan_file is not None:
+            keys = (found.path(i, '') for i in found.indices)
+            plan.write(plan_file, self.yaml_file, self.root_dir, self.placeholder_map, stages, tasks, keys, not_found)
+            print(f'Plan of {len(tasks)} nodes written to {plan_file}')
+            return Result(selected_mode, [], found, not_found)
+        return self.execute(selected_mode, stages, tasks, found, not_found, log_file, json_log)
+
+
+    def get_node(self, found:dirutils.NodeSet, stages:list, i:int) -> list:
+        """Returns the (path, command) pair of each stage of the i-th node
+        that was found, where the 'level' placeholders of the commands are
+        converted.
+        """
+        level_names = list(self.tree.keys())
+        node = []
+        for stage in stages:
+            path = found.path(found.indices[i], stage['suffix'])
             dirs = path.split('/')[1:]
-            levels = list(self.tree.keys())
-            level_map = {k:v for k,v in zip(levels,dirs)} | self.placeholder_map
-            tmp_cmd = YAMLutils.convert_handles(tmp_cmd, level_map)
+            level_map = dict(zip(level_names, dirs))
+            if stage['shell']:
+                tmp_cmd = stage['template'].render(level_map)
+            else:
+                tmp_cmd = [word.render(level_map) for word in stage['argv']]
+            node.append((path, tmp_cmd))
+        return node
+
+
+    def replay(self) -> Result:
+        """Runs the nodes of a precomputed plan, where only the shard (if any)
+        is selected. Plans are sharded like the tree, by the keys of their 
+        nodes or by the durations of their previous runs.
+        """
+        stages, nodes, keys = self.from_plan['stages'], self.from_plan['nodes'], self.from_plan['keys']
+        selected_mode = ' -> '.join(stage['mode'] for stage in stages)
+        broadcast.header('Summary:')
+        broadcast.tabulate(
+            {
+                'Mode:':selected_mode,
+                'Planned:':self.from_plan['created'],
+                'Root dir:':self.root_dir,
+                'Nodes:':len(nodes),
+            }
+        )
+
+        log_file, json_log = self.log_file, self.json_log
+        if self.shard is not None:
+            shard, count = self.shard
+            costs = None
+            if self.shard_by == 'history':
+                costs = self.predict(
+                    stages,
+                    lambda k: (None if node[k] is None else node[k][0] for node in nodes),
+                    '--shard-by history'
+                )
+            owners = dirutils.shard_owners(keys.__getitem__, len(keys), count, costs)
+            total = len(nodes)
+            nodes = [node for node, owner in zip(nodes, owners) if owner == shard-1]
+            print(f'Shard {shard} of {count}: {len(nodes)} of {total} nodes'+(' (balanced by history)' if costs is not None else ''))
+            log_file = None if log_file is None else shard_name(log_file, self.shard)
+            json_log = None if json_log is None else shard_name(json_log, self.shard)
+
+        broadcast.header(f'Submitting:')
+        tasks = runner.Tasks(len(nodes), len(stages), nodes.__getitem__)
+        found = [node[0][0] for node in nodes]
+        return self.execute(selected_mode, stages, tasks, found, self.from_plan['not_found'], log_file, json_log)
+
+
+    def predict(self, stages:list, paths, feature:str=None) -> list:
+        """Returns the expected duration of each node of a run, summed over
+        its stages, from the durations of their previous runs in the journal
+        (None if none of the nodes has run before).
+
+        Keyword arguments:
+          stages:   one stage per mode of the run (see get_stage)
+          paths:    returns the paths of the nodes in a stage, given its 
+                    position (None for nodes whose stage is not run)
+          feature:  the option that needs the journal, if it cannot run 
+                    without it (see read_journal)
+        """
+        expected = None
+        for k, stage in enumerate(stages):
+            stage_expected = runner.expected_durations(
+                paths(k),
+                self.read_journal(journal.durations, stage['mode'], feature)
+            )
+            if expected is None:
+                expected = stage_expected
+            elif stage_expected is not None:
+                for j, duration in enumerate(stage_expected):
+                    expected[j] += duration
+        return expected
 
-            # Attempt to run
+
+    def execute(self, selected_mode:str, stages:list, tasks:runner.Tasks, found:list, not_found:list, log_file:str, json_log:str) -> Result:
+        """Runs the resolved commands of the nodes of a run, skipping those
+        that are done or unchanged if so requested, and reports and logs the
+        outcome.
+
+        Keyword arguments:
+          selected_mode:  name of the mode (modes of a pipeline joined by '->')
+          stages:         one stage per mode of the run (see get_stage)
+          tasks:          the nodes, with a (path, command) pair per stage
+          found:          paths of the nodes that were found on the disk
+          not_found:      paths of the nodes that were not found on the disk
+          log_file:       name of the log file (None to not log)
+          json_log:       name of the JSON Lines log file (None to not log)
+        """
+        array = stages[0]['array']
+        cmd = ' && '.join(stage['cmd'] for stage in stages)
+
+        # Nodes that completed with the same command in a previous run of the
+        # mode are skipped when resuming
+        if self.resume:
+            done = [self.read_journal(journal.completed, stage['mode'], '--resume') for stage in stages]
+            skipped = 0
+            for i, node in enumerate(tasks):
+                for k, task in enumerate(node):
+                    if (task is not None) and ((task[0], runner.command_string(task[1])) in done[k]):
+                        tasks.skip(i, k)
+                        skipped += 1
+            print(f'Resuming: skipping {skipped} nodes completed in a previous run.')
+
+        # Every node is recorded in the journal as it starts and finishes, the
+        # run goes on without it if it cannot be written
+        journal_file = self.run_state()
+        observers = [[] for stage in stages]
+        if journal_file is not None:
             try:
-                os.chdir(self.root_dir+path)
-                broadcast.tabulate(
-                    {
-                        'Moving to:':path,
-                        'Running:':tmp_cmd,
-                    }
+                for k, stage in enumerate(stages):
+                    observers[k].append(journal.Journal(journal_file, stage['mode']))
+            except OSError as e:
+                print(f'Running without a journal, since it could not be opened: {e}')
+                for observer in itertools.chain(*observers):
+                    observer.close()
+                observers = [[] for stage in stages]
+
+        # Nodes whose run directory and command are unchanged since their last
+        # successful run are skipped
+        if self.changed_only:
+            if self.run_state() is None:
+                print('--changed-only needs run state, which is not kept for inputs given as dictionaries without a state_file')
+                ExitCode(6)
+            fingerprints = [
+                fingerprint.Fingerprints(
+                    self.run_state('fingerprints'),
+                    stage['mode'],
+                    self.root_dir,
+                    stage['params'].get('fingerprint', None),
                 )
-                subprocess.call(tmp_cmd, shell=True)
-                self.successful.append(path)
+                for stage in stages
+            ]
+            # Once a stage of a node runs, its later stages run as well, 
+            # since their inputs may be what it writes
+            skipped = 0
+            for i, node in enumerate(tasks):
+                for k, task in enumerate(node):
+                    if task is None:
+                        continue
+                    if fingerprints[k].changed(task[0], runner.command_string(task[1])):
+                        break
+                    tasks.skip(i, k)
+                    skipped += 1
+            for k, stage in enumerate(stages):
+                observers[k].append(fingerprints[k])
+            print(f'Changed only: skipping {skipped} unchanged nodes.')
+        tasks.select()
 
-            # Log unsuccessful attempts
-            except FileNotFoundError as e:
-                print(e)
-                print('Proceding to next file.')
-                self.unsuccessful.append(path)
+        # Records of each node are logged as soon as the node finishes
+        if json_log is not None:
+            run_log = journal.RunLog(
+                os.path.join(self.root_dir, json_log),
+                stages[0]['mode']
+            )
+            for k, stage in enumerate(stages):
+                observers[k].append(run_log.for_mode(stage['mode']))
+
+        # Output of each node is streamed to its own files
+        capture = None
+        if self.capture is not None:
+            capture = runner.Capture(
+                os.path.join(self.root_dir, self.capture) if self.capture != '' else None,
+                tail=self.tail,
+            )
+
+        # Starts are paused while the machine is busy or short of memory, 
+        # where the 'memory' option of a mode is the expected peak per node
+        throttle = None
+        if self.adaptive or any('memory' in stage['params'] for stage in stages):
+            throttle = runner.Throttle(
+                runner.get_jobs(self.jobs),
+                memory=max(runner.parse_size(stage['params'].get('memory', 0)) for stage in stages),
+            )
+
+        # Concurrent nodes are started longest first according to the 
+        # durations of their previous runs, nodes without one keep their order
+        order, expected = None, None
+        if (array is None) and (runner.get_jobs(self.jobs) > 1):
+            expected = self.predict(
+                stages,
+                lambda k: (None if node[k] is None else node[k][0] for node in tasks)
+            )
+        if expected is not None:
+            order = runner.longest_first(expected)
+            tasks.reorder(order)
+
+        # Each node runs in its own working directory, up to 'jobs' at a time,
+        # unless all nodes are submitted at once as a job array
+        try:
+            if array is not None:
+                self.records = batch.submit(
+                    [node[0] for node in tasks],
+                    self.root_dir,
+                    array,
+                    self.placeholder_map,
+                    observers=observers[0],
+                )
+            else:
+                self.records = runner.run_nodes(
+                    tasks,
+                    self.root_dir,
+                    jobs=self.jobs,
+                    observers=observers,
+                    capture=capture,
+                    throttle=throttle,
+                    retries=[int(stage['params'].get('retries', 0)) for stage in stages],
+                    backoff=[float(stage['params'].get('backoff', 1.0)) for stage in stages],
+                    abort_rate=self.abort_rate,
+                    stop=self.stop,
+                )
+
+            # Stages that were skipped as unchanged are fingerprinted again
+            # after the later stages of their node ran, which may write to 
+            # the same run dir
+            if self.changed_only:
+                for j in range(len(tasks)):
+                    i = tasks.position(j)
+                    for k, task in enumerate(tasks.render(i)):
+                        if tasks.skipped[k][i]:
+                            fingerprints[k].refresh(task[0], runner.command_string(task[1]))
+        finally:
+            for observer in itertools.chain(*observers):
+                try:
+                    observer.close()
+                except OSError as e:
+                    print(f'Could not write the run state: {e}')
+        if journal_file is not None:
+            journal.compact(journal_file)
+
+        # Records are kept in the order of the tree
+        if order is not None:
+            self.records.sort(key=tasks.position)
+        if (throttle is not None) and (throttle.pauses > 0):
+            print(f'Throttled: {throttle.pauses} nodes waited for the load or memory to allow them to start.')
+        if array is None:
+            runner.report(self.records, top=self.top, modes=[stage['mode'] for stage in stages])
+        if (expected is not None) and (len(self.records) > 0):
+            jobs = runner.get_jobs(self.jobs)
+            start = min(datetime.datetime.fromisoformat(r['start']) for r in self.records)
+            end = max(datetime.datetime.fromisoformat(r['end']) for r in self.records)
+            broadcast.header('Makespan:')
+            broadcast.tabulate(
+                {
+                    'Predicted (longest first):':f'{runner.makespan([expected[i] for i in order], jobs):.2f} s',
+                    'Predicted (tree order):':f'{runner.makespan(expected, jobs):.2f} s',
+                    'Actual:':f'{(end-start).total_seconds():.2f} s',
+                }
+            )
 
         # Lengths of all paths, used for even tabulating
-        max_length = max([len(string) for string in found+not_found+self.unsuccessful])
+        found_length = found.max_length() if type(found) == dirutils.NodeSet else max([0]+[len(path) for path in found])
+        max_length = max(
+            [found_length]+[len(string) for string in not_found]+[len(r['path']) for r in self.records if runner.failed(r)]
+        )
 
         # Logging
-        if self.log_file is not None:
+        if log_file is not None:
             self.logger(
-                self.log_file,
+                log_file,
                 selected_mode,
                 cmd,
                 max_length,
                 found,
                 not_found
             )
+        return Result(selected_mode, self.records, found, not_found)
+
+
+def exit_code(error:TreerunError) -> None:
+    """Exits the command line program with the exit code of an error."""
+    print(f'exit code: {error.exit_code}')
+    sys.exit()
+
 
+def main(argv:list=None):
+    args = argument_parser(argv)
 
-def main():
     # Example flag
     if args.example:
         print(example_tree)
@@ -396,24 +1115,47 @@ def main():
         #quit()
 
     elif args.plant:
-        tree = Tree(
-            yaml_data=args.input,
-            modifier=args.modifier,
-            excluded=args.excluded,
-            select_all=True,
-            log_file=args.output,
-        )
-        tree.plant()
+        try:
+            tree = Tree(
+                yaml_data=args.input,
+                modifier=args.modifier,
+                excluded=args.excluded,
+                select_all=True,
+                log_file=args.output,
+                jobs=args.jobs,
+                use_cache=not args.no_cache,
+            )
+            tree.plant(dry_run=args.dry_run)
+        except TreerunError as e:
+            exit_code(e)
 
     else:
-        tree = Tree(
-            yaml_data=args.input,
-            modifier=args.modifier,
-            excluded=args.excluded,
-            select_all=args.all,
-            log_file=args.output,
-        )
-        tree.climb()
+        try:
+            tree = Tree(
+                yaml_data=args.input,
+                modifier=args.modifier,
+                excluded=args.excluded,
+                select_all=args.all,
+                log_file=args.output,
+                jobs=args.jobs,
+                use_cache=not args.no_cache,
+                resume=args.resume,
+                changed_only=args.changed_only,
+                json_log=args.json_log,
+                top=args.top,
+                capture=args.capture,
+                tail=args.tail,
+                selections=args.select,
+                adaptive=args.adaptive,
+                abort_rate=args.abort_rate,
+                shard=args.shard,
+                shard_by=args.shard_by,
+                plan_file=args.plan,
+                from_plan=args.from_plan,
+            )
+            tree.climb()
+        except TreerunError as e:
+            exit_code(e)
 
 
 if __name__ == '__main__':
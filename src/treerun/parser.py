@@ -1,6 +1,5 @@
 #!/usr/bin/python
 
-from importlib.metadata import version
 import argparse
 
 description = """
@@ -113,13 +112,17 @@ should look like.
 
 # 80-23=57 spaces wide
 
-version_help = f'\
-treerun ver. {version("treerun")}'
+version_help = """show the version number and exit
+"""
 
 plant_help = """attempts to plant a tree as defined in the input YAML-
 file
 """
 
+dry_run_help = """used together with --plant to report how many directories
+would be created, without creating them
+"""
+
 modifier_help = """modifiers are used to substitute {mod} in the \'Modes\' 
 block of the input YAML-file
 """
@@ -131,7 +134,14 @@ tree.yaml in the working directory)
 """
 
 exclude_help = """the program will exclude all nodes corresponding to any 
-dir-name given here
+dir-name given here, which may also be glob patterns
+(e.g. 'seed-0*') or regexes (e.g. 're:seed-\\d+[13]')
+"""
+
+select_help = """selects the directories of a level without a prompt as
+LEVEL=EXPR, where EXPR is a comma separated list of
+indices (e.g. 3), index ranges (e.g. 2-5), names, glob
+patterns or a final re:REGEX (can be given repeatedly)
 """
 
 all_help = """automatically selects all non-excluded paths without any
@@ -143,6 +153,73 @@ were not will be stored in a log file with the name
 given here
 """
 
+resume_help = """skip the nodes that already completed with the same mode
+and command according to the run journal (stored next
+to the input file)
+"""
+
+changed_only_help = """only run the nodes whose run directory or command has 
+changed since their last successful run (see the
+'fingerprint' option of a mode)
+"""
+
+no_cache_help = """always parse the input file instead of using the cached
+version of it
+"""
+
+jobs_help = """maximum number of nodes that are run at the same time
+(0 uses one per core, defaults to 1)
+"""
+
+adaptive_help = """lower the number of nodes that run at the same time (at
+most --jobs) while the load average leaves no core free
+or the available memory is short of the 'memory' option
+of the mode, which also enables this
+"""
+
+abort_rate_help = """stop starting new nodes once more than this fraction 
+(e.g. 0.5) of the finished nodes have failed, counted
+from the tenth finished node onwards
+"""
+
+shard_help = """only run shard i of N disjoint shards of the selected
+nodes (e.g. 2/4), which are the same on every host, and
+write the logs to e.g. run.shard-2-of-4.log
+"""
+
+shard_by_help = """assign nodes to shards by a hash of their path (default)
+or balanced by the durations of their previous runs
+"""
+
+plan_help = """resolve the selected nodes and write the run directory and
+fully rendered command of each of them to a JSON plan
+with the name given here, without running anything
+"""
+
+from_plan_help = """run the nodes of a plan written with --plan as they are,
+without reading the input or walking the tree
+"""
+
+json_log_help = """one record per node (path, mode, command, start and end
+times, duration and exit status) will be appended to a
+JSON Lines log file with the name given here, as soon
+as each node finishes
+"""
+
+top_help = """number of slowest and most memory-hungry nodes that are
+reported at the end of a run (0 disables the report,
+defaults to 5)
+"""
+
+capture_help = """stream the stdout and stderr of each node to the files
+treerun.out and treerun.err in its run directory, or in a
+log tree with the same levels under the dir given here
+"""
+
+tail_help = """used together with --capture to show the last lines of
+the output of each node when it finishes (defaults to 0)
+"""
+
 codes_help = """legend for exit codes
 """
 
@@ -153,7 +230,31 @@ associated input file
 
 
 
-def argument_parser():
+def shard_type(value:str) -> tuple:
+    """Parses a shard given as 'i/N' into (i, N)."""
+    try:
+        shard, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'shards are given as i/N, not {value}')
+    if not 1 <= shard <= count:
+        raise argparse.ArgumentTypeError(f'shard must be between 1 and {count}')
+    return shard, count
+
+
+class VersionAction(argparse.Action):
+    """Prints the version of the program, which is looked up only when the
+    flag is given since reading package metadata is slow.
+    """
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from importlib.metadata import version
+        print(f'treerun ver. {version("treerun")}')
+        parser.exit()
+
+
+def argument_parser(argv:list=None):
     parser = argparse.ArgumentParser(
         prog='trn',
         description=description,
@@ -167,6 +268,10 @@ def argument_parser():
         '-p', '--plant', action='store_true',
         help=plant_help,
     )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help=dry_run_help,
+    )
     parser.add_argument(
         '-i', '--input', default='tree.yaml',
         help=input_help,
@@ -183,13 +288,73 @@ def argument_parser():
         '-o', '--output', default=None,
         help=log_help,
     )
+    parser.add_argument(
+        '--plan', default=None, metavar='FILE',
+        help=plan_help,
+    )
+    parser.add_argument(
+        '--from-plan', default=None, metavar='FILE',
+        help=from_plan_help,
+    )
+    parser.add_argument(
+        '--json-log', default=None,
+        help=json_log_help,
+    )
+    parser.add_argument(
+        '--top', type=int, default=5,
+        help=top_help,
+    )
+    parser.add_argument(
+        '--capture', nargs='?', const='', default=None,
+        help=capture_help,
+    )
+    parser.add_argument(
+        '--tail', type=int, default=0,
+        help=tail_help,
+    )
     parser.add_argument(
         '-e', '--excluded', nargs='+', default=[],
         help=exclude_help,
     )
+    parser.add_argument(
+        '-s', '--select', action='append', default=[], metavar='LEVEL=EXPR',
+        help=select_help,
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help=jobs_help,
+    )
+    parser.add_argument(
+        '--adaptive', action='store_true',
+        help=adaptive_help,
+    )
+    parser.add_argument(
+        '--abort-rate', type=float, default=None,
+        help=abort_rate_help,
+    )
+    parser.add_argument(
+        '--shard', type=shard_type, default=None, metavar='i/N',
+        help=shard_help,
+    )
+    parser.add_argument(
+        '--shard-by', choices=['hash', 'history'], default='hash',
+        help=shard_by_help,
+    )
+    parser.add_argument(
+        '-r', '--resume', action='store_true',
+        help=resume_help,
+    )
+    parser.add_argument(
+        '-c', '--changed-only', action='store_true',
+        help=changed_only_help,
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help=no_cache_help,
+    )
     info.add_argument(
-        '--version', action='version',
-        version=version_help,
+        '--version', action=VersionAction,
+        help=version_help,
     )
     info.add_argument(
         '--example', action='store_true',
@@ -200,4 +365,7 @@ def argument_parser():
         help=codes_help,
     )
     
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.dry_run and not args.plant:
+        parser.error('--dry-run can only be used together with --plant')
+    return args
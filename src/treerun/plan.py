@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+import os
+import json
+import datetime
+
+"""Execution plans, which hold the run directory and fully rendered command of
+every selected node, so that a run can be inspected, diffed and replayed
+without parsing the input or walking the tree again."""
+
+# Version of the plan format, plans of other versions are not replayed
+version = 2
+
+# Options of a mode that still apply when a plan is executed
+stage_options = ['retries', 'backoff', 'memory', 'fingerprint']
+
+
+def write(plan_file:str, input_file:str, root_dir:str, placeholder_map:dict, stages:list, nodes:list, keys:list, not_found:list) -> None:
+    """Writes a plan as JSON, with one line per node so that plans can be
+    compared line by line. Each node is stored with its key, i.e. its path
+    without the run dir, by which plans are sharded like the tree.
+
+    Keyword arguments:
+      plan_file:        path of the plan
+      input_file:       the input file, which run state is kept next to 
+                        (None for inputs given as dictionaries, which keep
+                        no run state)
+      root_dir:         root-dir that contains the tree structure
+      placeholder_map:  values of the placeholders (used by job arrays)
+      stages:           one stage per mode of the run (see Tree.get_stage)
+      nodes:            one list per node, with a (path, command) pair per
+                        stage, which are iterated over once
+      keys:             the key of each node
+      not_found:        paths that were not found on the disk
+    """
+    header = dict(
+        version=version,
+        created=datetime.datetime.now().isoformat(),
+        input=None if input_file is None else os.path.abspath(input_file),
+        root_dir=root_dir,
+        placeholders=placeholder_map,
+        stages=[
+            dict(
+                mode=stage['mode'],
+                cmd=stage['cmd'],
+                run_dir=stage['run_dir'],
+                array=stage['array'],
+                params={k:v for k, v in stage['params'].items() if k in stage_options},
+            )
+            for stage in stages
+        ],
+        not_found=not_found,
+    )
+
+    # Written next to the plan first, so that a plan is never left half done
+    tmp_file = f'{plan_file}.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write('{\n')
+        for key, value in header.items():
+            f.write(f' {json.dumps(key)}: {json.dumps(value, default=str)},\n')
+        f.write(' "nodes": [\n')
+        for i, (key, node) in enumerate(zip(keys, nodes)):
+            line = json.dumps(dict(node=key, stages=[list(stage) for stage in node]))
+            f.write((',\n' if i > 0 else '')+'  '+line)
+        f.write('\n ]\n}\n')
+    os.replace(tmp_file, plan_file)
+
+
+def read(plan_file:str) -> dict:
+    """Returns the contents of a plan, where each node is a list with a
+    (path, command) pair per stage, and the keys of the nodes are listed 
+    separately.
+
+    Raises ValueError if the file is not a plan of this version.
+    """
+    with open(plan_file, 'r') as f:
+        try:
+            plan = json.load(f)
+        except ValueError:
+            raise ValueError(f'{plan_file} is not a valid plan.')
+    if (type(plan) != dict) or (plan.get('version') != version):
+        raise ValueError(f'{plan_file} is not a plan of version {version}.')
+    plan['keys'] = [node['node'] for node in plan['nodes']]
+    plan['nodes'] = [[tuple(stage) for stage in node['stages']] for node in plan['nodes']]
+    return plan
@@ -0,0 +1,878 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import errno
+import signal
+import datetime
+import threading
+from array import array
+from collections.abc import Sequence
+
+from treerun import broadcast
+
+"""Methods for running commands at the nodes of a tree, either one node at a
+time or several nodes concurrently."""
+
+# Keeps lines printed by concurrent workers from interleaving
+print_lock = threading.Lock()
+
+
+def get_jobs(jobs:int) -> int:
+    """Returns the number of workers to use, where 0 (or less) means one
+    worker per available core.
+    """
+    if jobs is None:
+        return 1
+    elif jobs < 1:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def parse_size(size:str or int) -> int:
+    """Returns a memory size in KiB, given as a number of MiB or as a string
+    with a binary unit, e.g. '512M' or '4G'.
+    """
+    units = dict(K=1, M=1024, G=1024**2, T=1024**3)
+    if type(size) in [int, float]:
+        return int(size*1024)
+    size = str(size).strip().upper().removesuffix('IB').removesuffix('B')
+    if (len(size) > 0) and (size[-1] in units):
+        return int(float(size[:-1])*units[size[-1]])
+    return int(float(size)*1024)
+
+
+def available_memory() -> int:
+    """Returns the memory (KiB) that is available for starting new processes
+    without swapping, according to /proc/meminfo (None where this is not
+    available).
+    """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class Throttle:
+    """Limits the number of nodes that run at the same time to what the 
+    machine can take, re-evaluated each time a node is about to start.
+
+    A node is only started if the load average leaves a core free for it and
+    if the available memory covers the memory estimate of the node on top of
+    a reserve. Starts are paused, rather than failed, until enough nodes have
+    finished, and one node is always allowed to run so that the run makes 
+    progress. Nodes that recently started are assumed to still be growing 
+    towards their estimate.
+
+    Attributes:
+      max_jobs:  upper limit of nodes that run at the same time
+      memory:    expected peak memory (KiB) of each node (0 if unknown)
+      reserve:   memory (KiB) that is always left available
+      interval:  time (s) between checks while a start is paused
+      running:   number of nodes that are currently running
+      pauses:    number of starts that had to wait
+
+    Methods:
+      limit:     returns the number of nodes that may run right now
+      acquire:   waits until a node may start
+      release:   marks a node as finished
+    """
+    def __init__(self, max_jobs:int, memory:int=0, reserve:int=512*1024, interval:float=1.0) -> None:
+        self.max_jobs = max_jobs
+        self.memory = memory
+        self.reserve = reserve
+        self.interval = interval
+        self.running = 0
+        self.pauses = 0
+        self.started = []
+        self.condition = threading.Condition()
+
+    def limit(self) -> int:
+        """Returns the number of nodes that may run right now, which is at 
+        least the number that is already running if resources are short.
+        """
+        limit = self.max_jobs
+        if hasattr(os, 'getloadavg'):
+            # The load of the running nodes is already part of the average
+            idle = (os.cpu_count() or 1)-os.getloadavg()[0]
+            limit = min(limit, self.running+max(0, int(idle)))
+
+        available = available_memory()
+        if available is not None:
+            # Nodes started within the last interval have probably not
+            # reached their peak memory yet
+            now = time.monotonic()
+            self.started = [t for t in self.started if now-t < self.interval]
+            available -= self.memory*len(self.started)
+            if available-self.reserve < self.memory:
+                limit = min(limit, self.running)
+        return limit
+
+    def acquire(self) -> None:
+        with self.condition:
+            paused = False
+            while (self.running > 0) and (self.running >= self.limit()):
+                if not paused:
+                    self.pauses += 1
+                    paused = True
+                self.condition.wait(self.interval)
+            self.running += 1
+            self.started.append(time.monotonic())
+
+    def release(self) -> None:
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+
+# Characters and leading words of a command that require it to be run by a
+# shell, commands without any of them are run directly
+shell_characters = set('|&;<>()$`\\"\'*?[]{}#~!\n')
+shell_words = {
+    'cd', 'export', 'source', '.', 'exit', 'set', 'unset', 'alias', 'eval',
+    'exec', 'if', 'for', 'while', 'until', 'case', 'function', 'time',
+    'ulimit', 'umask', 'trap', 'read', 'wait', 'shopt', '!',
+}
+
+
+def needs_shell(words:list) -> bool:
+    """Checks if a command that has been split into words uses any shell
+    features, e.g. pipes, redirection, globs, variables or builtins.
+
+    Keyword arguments:
+      words:  the words of the command (only their literal text matters)
+    """
+    if len(words) == 0:
+        return True
+    if (words[0] in shell_words) or ('=' in words[0]):
+        return True
+    return any(shell_characters.intersection(word) for word in words)
+
+
+def command_string(cmd:str or list) -> str:
+    """Returns a command as a string, where commands that are run without a 
+    shell are given as a list of arguments.
+    """
+    if type(cmd) == str:
+        return cmd
+    import shlex
+    return shlex.join(cmd)
+
+
+# ru_maxrss is given in bytes on macOS and in kilobytes elsewhere
+maxrss_scale = 1024 if sys.platform == 'darwin' else 1
+
+
+def reap(process) -> tuple:
+    """Waits for a child process to finish and returns its exit status along
+    with its resource usage (None where this is not available).
+
+    The resource usage covers the child and all of its descendants that it
+    waited for, e.g. the command started by the shell.
+
+    Keyword arguments:
+      process:  a running subprocess.Popen object
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    try:
+        _, wait_status, usage = os.wait4(process.pid, 0)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+    return process.returncode, usage
+
+
+class Children:
+    """Child processes of the nodes that are running, which can all be 
+    killed at once, e.g. when a run is cancelled. Children that are added 
+    after they have been killed are killed right away.
+
+    Attributes:
+      processes:  the running child processes
+      killed:     whether the children have been killed
+
+    Methods:
+      add:        adds a child that has been started
+      discard:    removes a child that has been waited for
+      kill:       kills all running children and returns how many there were
+    """
+    def __init__(self) -> None:
+        self.processes = set()
+        self.killed = False
+        self.lock = threading.Lock()
+
+    def add(self, process) -> None:
+        with self.lock:
+            self.processes.add(process)
+            if self.killed:
+                self.signal(process)
+
+    def discard(self, process) -> None:
+        with self.lock:
+            self.processes.discard(process)
+
+    def kill(self) -> int:
+        with self.lock:
+            self.killed = True
+            for process in self.processes:
+                self.signal(process)
+            return len(self.processes)
+
+    @staticmethod
+    def signal(process) -> None:
+        # Popen.kill would poll, and so reap, the child that reap waits for
+        try:
+            if hasattr(os, 'wait4'):
+                os.kill(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
+
+class Capture:
+    """Streams the stdout and stderr of each node to its own pair of files,
+    either inside the run directory of the node or in a separate log tree
+    that mirrors the levels of the tree.
+
+    The output is written by the children directly to the files, which keeps
+    the memory use of the program flat regardless of how much the commands 
+    print. A tail of the output can be shown on the console when a node 
+    finishes, which is read back from the end of the files.
+
+    Attributes:
+      capture_dir:  absolute path of the log tree (None for the run dirs)
+      tail:         number of lines of each stream shown on the console
+      max_bytes:    maximum number of bytes read back to show the tail
+
+    Methods:
+      files:        returns the stdout and stderr files of a node
+      open:         opens the stdout and stderr files of a node
+      show_tail:    prints the tail of the output of a node
+    """
+    names = ('treerun.out', 'treerun.err')
+
+    def __init__(self, capture_dir:str=None, tail:int=0, max_bytes:int=1 << 16) -> None:
+        self.capture_dir = capture_dir
+        self.tail = tail
+        self.max_bytes = max_bytes
+
+    def files(self, path:str, root_dir:str) -> tuple:
+        base = root_dir if self.capture_dir is None else self.capture_dir
+        return tuple(f'{base}{path}/{name}' for name in self.names)
+
+    def open(self, path:str, root_dir:str, append:bool=False) -> tuple:
+        files = self.files(path, root_dir)
+        if self.capture_dir is not None:
+            os.makedirs(os.path.dirname(files[0]), exist_ok=True)
+        return tuple(open(f, 'ab' if append else 'wb') for f in files)
+
+    def show_tail(self, path:str, root_dir:str) -> None:
+        if self.tail < 1:
+            return
+        lines = []
+        for symbol, file in zip('|!', self.files(path, root_dir)):
+            lines.extend(f'{path} {symbol} {line}' for line in tail_lines(file, self.tail, self.max_bytes))
+        if len(lines) > 0:
+            with print_lock:
+                print('\n'.join(lines))
+
+
+def tail_lines(file:str, n:int, max_bytes:int=1 << 16) -> list:
+    """Returns the last lines of a file, reading at most 'max_bytes' from 
+    the end of it.
+    """
+    try:
+        with open(file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size-max_bytes))
+            data = f.read()
+    except OSError:
+        return []
+    lines = data.decode(errors='replace').splitlines()
+    if size > max_bytes:
+        # First line is most likely cut short
+        lines = lines[1:]
+    return lines[-n:]
+
+
+class Tasks(Sequence):
+    """Tasks of a run, i.e. a (path, command) pair for each stage of each
+    node, in the order in which the nodes are run. The pairs of a node are
+    rendered each time it is accessed, e.g. when it is about to run, so that
+    no strings are kept for the nodes that are waiting or done.
+
+    Attributes:
+      count:    number of nodes
+      render:   returns the list of (path, command) pairs of a node from its
+                position, e.g. in a NodeSet
+      skipped:  one bytearray per stage that marks the nodes whose stage is
+                skipped
+      order:    positions of the nodes that are run, in the order they are 
+                run (None for all nodes in the order of their positions)
+
+    Methods:
+      skip:     skips a stage of a node
+      select:   keeps only the nodes with stages left to run
+      reorder:  changes the order in which the nodes are run
+      position: returns the position of the j-th node that is run
+    """
+    def __init__(self, count:int, stages:int, render) -> None:
+        self.count = count
+        self.render = render
+        self.skipped = [bytearray(count) for _ in range(stages)]
+        self.order = None
+
+    def skip(self, i:int, k:int) -> None:
+        self.skipped[k][i] = 1
+
+    def select(self) -> None:
+        self.order = array('Q', (
+            i for i in range(self.count) if not all(skipped[i] for skipped in self.skipped)
+        ))
+
+    def reorder(self, order:list) -> None:
+        """Runs the nodes in a new order, given as indices of the nodes in 
+        the current order.
+        """
+        self.order = array('Q', (self.position(j) for j in order))
+
+    def position(self, j:int) -> int:
+        return j if self.order is None else self.order[j]
+
+    def __len__(self) -> int:
+        return self.count if self.order is None else len(self.order)
+
+    def __getitem__(self, j:int) -> list:
+        if type(j) == slice:
+            return [self[j] for j in range(*j.indices(len(self)))]
+        if j < 0:
+            j += len(self)
+        if not 0 <= j < len(self):
+            raise IndexError('task index out of range')
+        i = self.position(j)
+        return [
+            None if self.skipped[k][i] else stage 
+            for k, stage in enumerate(self.render(i))
+        ]
+
+
+class Records(Sequence):
+    """Records of the runs of the stages of a list of tasks (see run_node),
+    which are kept as arrays of numbers instead of one dictionary per run. 
+    Each record is rendered as a dictionary when it is accessed, where its 
+    path and command are taken from its task.
+
+    Attributes:
+      tasks:     the tasks that were run
+      root_dir:  root-dir that contains the tree structure
+      capture:   the capture that the output of the tasks was streamed to
+      reasons:   why a task has no exit status, by record (e.g. 'not started')
+
+    Methods:
+      add:       stores the record of a stage of a task
+      sort:      sorts the records by their task, keeping the order of the 
+                 records of each task
+    """
+    # Stored in place of missing numbers
+    no_status = -2**31
+    epoch = datetime.datetime(1970, 1, 1)
+    microsecond = datetime.timedelta(microseconds=1)
+
+    def __init__(self, tasks:Sequence, root_dir:str, capture:'Capture'=None) -> None:
+        self.tasks = tasks
+        self.root_dir = root_dir
+        self.capture = capture
+        self.task = array('Q')
+        self.stage = array('B')
+        self.status = array('i')
+        self.attempt = array('H')
+        self.times = array('q')
+        self.usage = array('d')
+        self.maxrss = array('q')
+        self.reasons = {}
+
+    def add(self, i:int, record:dict) -> None:
+        self.task.append(i)
+        self.stage.append(record.get('stage', 0))
+        self.status.append(self.no_status if record['status'] is None else record['status'])
+        self.attempt.append(record.get('attempt', 0))
+        self.times.extend(
+            (datetime.datetime.fromisoformat(record[key])-self.epoch)//self.microsecond
+            for key in ['start', 'end']
+        )
+        self.usage.extend(
+            float('nan') if record[key] is None else record[key]
+            for key in ['duration', 'utime', 'stime']
+        )
+        self.maxrss.append(-1 if record['maxrss'] is None else record['maxrss'])
+        if 'reason' in record:
+            self.reasons[len(self.task)-1] = record['reason']
+
+    def sort(self, key=None) -> None:
+        """Sorts the records by their task, or by a key of the index of their
+        task, where the records of each task keep their order.
+        """
+        order = sorted(range(len(self)), key=lambda j: self.task[j] if key is None else key(self.task[j]))
+        for name, width in [('task', 1), ('stage', 1), ('status', 1), ('attempt', 1), ('times', 2), ('usage', 3), ('maxrss', 1)]:
+            values = getattr(self, name)
+            setattr(self, name, array(values.typecode, (
+                values[width*j+w] for j in order for w in range(width)
+            )))
+        position = {j:new for new, j in enumerate(order) if j in self.reasons}
+        self.reasons = {position[j]:reason for j, reason in self.reasons.items()}
+
+    def __len__(self) -> int:
+        return len(self.task)
+
+    def __getitem__(self, j:int) -> dict:
+        if type(j) == slice:
+            return [self[j] for j in range(*j.indices(len(self)))]
+        if j < 0:
+            j += len(self)
+        path, cmd = self.tasks[self.task[j]][self.stage[j]]
+        status = None if self.status[j] == self.no_status else self.status[j]
+        duration, utime, stime = (None if u != u else u for u in self.usage[3*j:3*j+3])
+        record = dict(
+            path=path,
+            cmd=command_string(cmd),
+            start=(self.epoch+self.times[2*j]*self.microsecond).isoformat(),
+            end=(self.epoch+self.times[2*j+1]*self.microsecond).isoformat(),
+            duration=duration,
+            status=status,
+            utime=utime,
+            stime=stime,
+            maxrss=None if self.maxrss[j] < 0 else self.maxrss[j],
+            stdout=None,
+            stderr=None,
+            attempt=self.attempt[j],
+            stage=self.stage[j],
+        )
+        if (self.capture is not None) and (status is not None):
+            record['stdout'], record['stderr'] = self.capture.files(path, self.root_dir)
+        if j in self.reasons:
+            record['reason'] = self.reasons[j]
+        return record
+
+
+def run_node(path:str, cmd:str or list, root_dir:str, observers:list=(), capture:Capture=None, append:bool=False, children:Children=None) -> dict:
+    """Runs a command from a node in the tree and returns a record of the run
+    with its start and end times, its duration (wall time, s), its exit 
+    status (None if the node could not be entered), its user and system CPU
+    time (s), its maximum resident set size (KiB) and the files that its
+    output was captured in (if any).
+
+    The command is run in its own working directory, which means that the
+    working directory of the parent process is never changed.
+
+    Keyword arguments:
+      path:       path of the node relative to the root dir
+      cmd:        the command to be run, either a string that is run by a
+                  shell or a list of arguments that is executed directly
+      root_dir:   root-dir that contains the tree structure
+      observers:  objects (e.g. a journal) whose 'started' and 'finished'
+                  methods are called when the node starts and finishes
+      capture:    streams the output of the node to files if given
+      append:     appends the output to the captured files of an earlier 
+                  node that ran in the same directory
+      children:   keeps track of the child while it runs, so that it can be
+                  killed
+    """
+    import subprocess
+    argv, cmd = cmd, command_string(cmd)
+    with print_lock:
+        broadcast.tabulate(
+            {
+                'Moving to:':path,
+                'Running:':cmd,
+            }
+        )
+    for observer in observers:
+        observer.started(path, cmd)
+
+    start, clock = datetime.datetime.now(), time.perf_counter()
+    usage, streams = None, (None, None)
+    try:
+        # Missing run directories are checked before anything is opened in
+        # them, so that they are not taken for missing commands
+        if not os.path.isdir(root_dir+path):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), root_dir+path)
+        if capture is not None:
+            streams = capture.open(path, root_dir, append)
+        try:
+            process = subprocess.Popen(
+                argv,
+                shell=(type(argv) == str),
+                cwd=root_dir+path,
+                stdout=streams[0],
+                stderr=streams[1],
+            )
+
+        # Scripts without a '#!' line are run by a shell, as a shell would
+        except OSError as e:
+            if (e.errno != errno.ENOEXEC) or (type(argv) == str):
+                raise
+            process = subprocess.Popen(
+                cmd,
+                shell=True,
+                cwd=root_dir+path,
+                stdout=streams[0],
+                stderr=streams[1],
+            )
+        if children is not None:
+            children.add(process)
+        try:
+            status, usage = reap(process)
+        finally:
+            if children is not None:
+                children.discard(process)
+
+    # Missing run directories are also raised when the child is started, if
+    # they disappear in the meantime
+    except OSError as e:
+        with print_lock:
+            print(e)
+            if e.filename == root_dir+path:
+                print('Proceding to next file.')
+        if e.filename == root_dir+path:
+            status = None
+
+        # A directly executed command that cannot be found or run gets the
+        # same exit status as it would from a shell
+        elif type(e) == FileNotFoundError:
+            status = 127
+        else:
+            status = 126
+    finally:
+        for stream in streams:
+            if stream is not None:
+                stream.close()
+
+    record = dict(
+        path=path,
+        cmd=cmd,
+        start=start.isoformat(),
+        end=datetime.datetime.now().isoformat(),
+        duration=time.perf_counter()-clock,
+        status=status,
+        utime=None if usage is None else usage.ru_utime,
+        stime=None if usage is None else usage.ru_stime,
+        maxrss=None if usage is None else usage.ru_maxrss//maxrss_scale,
+        stdout=None,
+        stderr=None,
+    )
+    if (capture is not None) and (status is not None):
+        record['stdout'], record['stderr'] = capture.files(path, root_dir)
+        capture.show_tail(path, root_dir)
+    for observer in observers:
+        observer.finished(record)
+    return record
+
+
+def failed(record:dict) -> bool:
+    """Returns whether the run of a record failed, i.e. whether it did not 
+    exit with status 0, where nodes that were submitted to a batch scheduler
+    (without an exit status yet) do not count as failed.
+    """
+    return (record['status'] != 0) and (record.get('reason') != 'submitted')
+
+
+def not_started(path:str, cmd:str or list, observers:list=(), reason:str='not started') -> dict:
+    """Returns the record of a node that was never started, e.g. because the
+    run was aborted, which has no exit status but the reason instead. The 
+    observers are told that the node finished, so that it is accounted for
+    in the journal and the logs.
+    """
+    now = datetime.datetime.now().isoformat()
+    record = dict(
+        path=path,
+        cmd=command_string(cmd),
+        start=now,
+        end=now,
+        duration=None,
+        status=None,
+        utime=None,
+        stime=None,
+        maxrss=None,
+        stdout=None,
+        stderr=None,
+        reason=reason,
+    )
+    for observer in observers:
+        observer.finished(record)
+    return record
+
+
+def run_pipeline(stages:list, root_dir:str, observers:list, capture:Capture=None, first:int=0, attempt:int=0, children:Children=None) -> tuple:
+    """Runs the stages of a pipeline at a node one after the other, stopping
+    at the first stage that does not complete successfully. Returns the 
+    records of the completed stages along with the index and the record of 
+    the stage that failed (None and None if none did).
+
+    Keyword arguments:
+      stages:     list of (path, command) pairs, or None for stages that are
+                  skipped
+      root_dir:   root-dir that contains the tree structure
+      observers:  list of the observers of each stage
+      capture:    streams the output of each stage to files if given
+      first:      index of the stage to start from, e.g. when retrying it
+      attempt:    number of earlier attempts of the first stage
+      children:   keeps track of the running children (see run_node)
+    """
+    records = []
+    for k in range(first, len(stages)):
+        if stages[k] is None:
+            continue
+        path, cmd = stages[k]
+
+        # Output of earlier stages and attempts in the same directory is kept
+        append = (attempt > 0) or any(
+            (stage is not None) and (stage[0] == path) for stage in stages[:k]
+        )
+        record = run_node(path, cmd, root_dir, observers[k], capture, append=append, children=children)
+        record['stage'] = k
+        record['attempt'] = attempt
+        if record['status'] != 0:
+            return records, k, record
+        records.append(record)
+        attempt = 0
+    return records, None, None
+
+
+def run_nodes(tasks:Sequence, root_dir:str, jobs:int=1, observers:list=(), capture:Capture=None, throttle:Throttle=None, retries:int or list=0, backoff:float or list=1.0, abort_rate:float=None, abort_after:int=10, stop:threading.Event=None) -> Records:
+    """Runs a list of (path, command) tasks and returns the records of all 
+    runs in submission order. Tasks can also be pipelines, i.e. lists of 
+    stages that are run one after the other (see run_pipeline), and are only
+    accessed when they are started, e.g. from a Tasks object.
+
+    Nodes that exit with a non-zero status are retried after an exponential
+    backoff. Waiting nodes do not occupy a worker, so other nodes keep 
+    running in the meantime. Only the record of the last attempt of a node
+    is returned, while the observers are told about every attempt.
+
+    Keyword arguments:
+      tasks:        list of (path, command) pairs, or of lists of them
+      root_dir:     root-dir that contains the tree structure
+      jobs:         maximum number of nodes that are run at the same time
+      observers:    objects whose 'started' and 'finished' methods are 
+                    called when each node starts and finishes (a list of 
+                    them per stage if the tasks are pipelines)
+      capture:      streams the output of each node to files if given
+      throttle:     adapts the number of nodes that run at the same time to 
+                    the load and memory of the machine if given
+      retries:      number of times a failed node is retried (per stage if 
+                    the tasks are pipelines)
+      backoff:      delay (s) before the first retry, which doubles with each
+                    retry (per stage if the tasks are pipelines)
+      abort_rate:   stops starting new nodes once more than this fraction of
+                    the finished nodes have failed
+      abort_after:  number of nodes that have to finish before the failure
+                    rate is considered
+      stop:         stops the run when it is set, e.g. from another thread,
+                    where no more nodes are started and the running ones 
+                    are killed
+    """
+    import heapq
+    import collections
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    jobs = get_jobs(jobs)
+
+    # Single nodes are run as pipelines of a single stage
+    if (len(tasks) > 0) and (type(tasks[0]) != list):
+        tasks = [[task] for task in tasks]
+        observers, retries, backoff = [observers], [retries], [backoff]
+    if type(retries) != list:
+        retries = [retries]*(len(tasks[0]) if len(tasks) > 0 else 0)
+    if type(backoff) != list:
+        backoff = [backoff]*len(retries)
+
+    children = Children()
+
+    def run_task(i:int, first:int, attempt:int) -> tuple:
+        if throttle is None:
+            return run_pipeline(tasks[i], root_dir, observers, capture, first, attempt, children)
+        throttle.acquire()
+        try:
+            return run_pipeline(tasks[i], root_dir, observers, capture, first, attempt, children)
+        finally:
+            throttle.release()
+
+    def give_up(reason:str) -> None:
+        # Nodes that are not started are recorded at their first stage, so
+        # that they are accounted for
+        nonlocal next_task
+        while next_task < len(tasks):
+            task = tasks[next_task]
+            k = next(k for k, stage in enumerate(task) if stage is not None)
+            record = not_started(*task[k], observers[k], reason=reason)
+            record['stage'] = k
+            records.add(next_task, record)
+            next_task += 1
+
+    # Nodes are started in order, after the retries that are due
+    records = Records(tasks, root_dir, capture)
+    next_task, due = 0, collections.deque()
+    delayed, running = [], {}
+    finished, failed, aborted, stopped = 0, 0, False, False
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while (next_task < len(tasks)) or (len(due) > 0) or (len(delayed) > 0) or (len(running) > 0):
+            # Stopped runs start nothing more and kill what is running
+            if (stop is not None) and stop.is_set() and not stopped:
+                stopped, aborted = True, True
+                killed = children.kill()
+                with print_lock:
+                    print(f'Stopping: {len(tasks)-next_task} nodes are not started, {killed} running nodes are killed.')
+                give_up('not started (stopped)')
+
+            # Pending retries are given up on when aborting
+            if aborted:
+                for _, i, _, _, record in delayed:
+                    records.add(i, record)
+                for i, _, _, record in due:
+                    records.add(i, record)
+                delayed, due = [], collections.deque()
+
+            # Retries whose backoff has passed go to the front of the queue
+            while (len(delayed) > 0) and (delayed[0][0] <= time.monotonic()):
+                _, i, k, attempt, record = heapq.heappop(delayed)
+                due.append((i, k, attempt, record))
+            while ((len(due) > 0) or (next_task < len(tasks))) and (len(running) < jobs):
+                if len(due) > 0:
+                    i, k, attempt, _ = due.popleft()
+                else:
+                    i, k, attempt = next_task, 0, 0
+                    next_task += 1
+                running[pool.submit(run_task, i, k, attempt)] = i
+
+            timeout = None if len(delayed) == 0 else max(0, delayed[0][0]-time.monotonic())
+            if stop is not None:
+                timeout = 0.1 if timeout is None else min(timeout, 0.1)
+            if len(running) == 0:
+                if timeout is not None:
+                    time.sleep(timeout)
+                continue
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                stage_records, k, record = future.result()
+                for stage_record in stage_records:
+                    records.add(i, stage_record)
+                if record is not None:
+                    # Nodes that could not be entered are not retried
+                    if (record['status'] is not None) and (record['attempt'] < retries[k]) and not aborted:
+                        delay = backoff[k]*2**record['attempt']
+                        with print_lock:
+                            print(f'Retrying {record["path"]} in {delay:g} s (exit status {record["status"]}, attempt {record["attempt"]+2} of {retries[k]+1})')
+                        heapq.heappush(delayed, (time.monotonic()+delay, i, k, record['attempt']+1, record))
+                        continue
+                    records.add(i, record)
+
+                    # Nodes that could not be entered do not count as failed
+                    if record['status'] is not None:
+                        failed += 1
+                finished += 1
+
+                # Stops the sweep when most nodes are failing
+                if (abort_rate is not None) and not aborted and (finished >= abort_after) and (failed/finished > abort_rate):
+                    aborted = True
+                    with print_lock:
+                        print(f'Aborting: {failed} of {finished} nodes failed, {len(tasks)-next_task} nodes are not started.')
+                    give_up('not started (aborted)')
+
+    records.sort()
+    return records
+
+
+def expected_durations(paths:list, history:dict) -> list:
+    """Returns the expected duration (s) of the node at each path from the 
+    durations of previous runs of it (None if none of them have a history).
+    Nodes without a history are expected to take the median duration of the
+    rest, and nodes that are not run (None) to take no time.
+
+    Keyword arguments:
+      paths:    paths of the nodes, which are iterated over once
+      history:  durations (s) of previous runs of the paths
+    """
+    expected, known = array('d'), []
+    for path in paths:
+        if path is None:
+            expected.append(0.0)
+        elif path in history:
+            expected.append(history[path])
+            known.append(history[path])
+        else:
+            expected.append(float('nan'))
+    if len(known) == 0:
+        return None
+    known.sort()
+    median = known[len(known)//2]
+    return array('d', (median if d != d else d for d in expected))
+
+
+def longest_first(expected:list) -> list:
+    """Returns the order in which to start nodes of expected durations, 
+    longest first, as a list of their indices.
+
+    Starting the longest nodes first keeps a single long node from being 
+    started last and running on its own at the end (LPT scheduling). Nodes
+    with the same expected duration keep their order.
+    """
+    return array('Q', sorted(range(len(expected)), key=lambda i: -expected[i]))
+
+
+def makespan(durations:list, jobs:int) -> float:
+    """Returns the time it takes to run nodes of given durations in the given
+    order, where each node starts as soon as one of 'jobs' workers is free.
+    """
+    import heapq
+    workers = [0.0]*min(max(jobs, 1), max(len(durations), 1))
+    for duration in durations:
+        heapq.heapreplace(workers, workers[0]+duration)
+    return max(workers)
+
+
+def report(records:list, top:int=5, modes:list=None) -> None:
+    """Prints the slowest and the most memory-hungry nodes of a run.
+
+    Keyword arguments:
+      records:  records of the run (see run_node)
+      top:      number of nodes shown in each list
+      modes:    names of the stages of a pipeline, which label the runs of
+                each node so that stages in the same run dir are told apart
+    """
+    import heapq
+    if top < 1:
+        return
+
+    def label(r:dict) -> str:
+        if (modes is None) or (len(modes) < 2):
+            return r['path']
+        return f'{r["path"]} ({modes[r.get("stage", 0)]})'
+
+    slowest = heapq.nlargest(top, (r for r in records if r['status'] is not None), key=lambda r: r['duration'])
+    if len(slowest) == 0:
+        return
+
+    broadcast.header(f'Slowest nodes:')
+    broadcast.tabulate(
+        {
+            label(r):f'{r["duration"]:.2f} s wall'+(
+                '' if r['utime'] is None else f', {r["utime"]:.2f} s user, {r["stime"]:.2f} s sys'
+            )
+            for r in slowest
+        }
+    )
+
+    hungriest = heapq.nlargest(top, (r for r in records if (r['status'] is not None) and (r['maxrss'] is not None)), key=lambda r: r['maxrss'])
+    if len(hungriest) > 0:
+        broadcast.header(f'Most memory-hungry nodes:')
+        broadcast.tabulate({label(r):f'{r["maxrss"]/1024:.1f} MiB max RSS' for r in hungriest})
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import tempfile
+import contextlib
+import tracemalloc
+from array import array
+
+from treerun import dirutils
+from treerun.main import Tree
+
+# Compares the memory held by the leaves of a large sweep when they are kept
+# as a list of path strings and as a NodeSet of mixed-radix indices.
+# The peak memory of climbing a planted tree is measured as well, at two sizes,
+# to check that what climb keeps per node stays within a budget.
+# usage: python3 bench_memory.py [leaves per level] [levels] [min ratio] [bytes per node]
+def measure(build) -> tuple:
+	tracemalloc.start()
+	start = time.perf_counter()
+	nodes = build()
+	elapsed = time.perf_counter()-start
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return nodes, current, peak, elapsed
+
+def climb_peak(root:str, width:int) -> tuple:
+	"""Plants a tree of two levels of 'width' directories each, runs a 
+	command at every leaf, and returns the number of runs and the peak memory
+	of the climb."""
+	tree = {
+		'Level 0':[f'a{i:04d}' for i in range(width)],
+		'Level 1':[f'b{i:04d}' for i in range(width)],
+	}
+	for a in tree['Level 0']:
+		for b in tree['Level 1']:
+			os.makedirs(os.path.join(root, a, b), exist_ok=True)
+	yaml_data = {'Root':root, 'Tree':tree, 'Modes':{'Noop':{'cmd':'true'}}}
+	with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+		tree = Tree(yaml_data, use_cache=False, interactive=False)
+		(result, _, peak, _) = measure(lambda: tree.climb(mode='Noop'))
+	return len(result.records), result.ok, peak
+
+if __name__ == '__main__':
+	width = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+	depth = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+	min_ratio = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+	budget = float(sys.argv[4]) if len(sys.argv) > 4 else 512
+	tree = {f'Level {i}':[f'dir{i}-{j:04d}' for j in range(width)] for i in range(depth)}
+	leaves = width**depth
+
+	strings, strings_held, strings_peak, strings_time = measure(
+		lambda: dirutils.get_paths(tree)
+	)
+	nodes, nodes_held, nodes_peak, nodes_time = measure(
+		lambda: dirutils.NodeSet(list(tree.values()), indices=array('Q', range(leaves)))
+	)
+
+	# Both representations must describe the same paths
+	failed = False
+	if (len(nodes) != len(strings)) or (nodes.path(nodes.indices[-1]) != strings[-1]):
+		print('FAIL: the node set does not match the list of paths')
+		failed = True
+	if nodes.max_length() != max(len(s) for s in strings):
+		print('FAIL: the longest path differs between the representations')
+		failed = True
+	del strings
+
+	print(f'Leaves: {leaves}')
+	print('Representation:\tHeld (MiB):\tPeak (MiB):\tTime (s):')
+	print(f'Path strings\t{strings_held/2**20:.1f}\t\t{strings_peak/2**20:.1f}\t\t{strings_time:.2f}')
+	print(f'NodeSet\t\t{nodes_held/2**20:.1f}\t\t{nodes_peak/2**20:.1f}\t\t{nodes_time:.2f}')
+	ratio = strings_held/max(nodes_held, 1)
+	print(f'Ratio: {ratio:.1f}')
+	if ratio < min_ratio:
+		print(f'FAIL: the node set uses less than {min_ratio} times less memory')
+		failed = True
+
+	# Memory that climb takes per node, from the growth of its peak between
+	# a small and a large tree
+	with tempfile.TemporaryDirectory() as root:
+		climb_peak(os.path.join(root, 'warm-up'), 5)
+		small, small_ok, small_peak = climb_peak(os.path.join(root, 'small'), 20)
+		large, large_ok, large_peak = climb_peak(os.path.join(root, 'large'), 60)
+	if not (small_ok and large_ok):
+		print('FAIL: not all nodes of the climb ran successfully')
+		failed = True
+	per_node = (large_peak-small_peak)/(large-small)
+	print(f'Climb peak: {small_peak/2**20:.1f} MiB for {small} nodes, {large_peak/2**20:.1f} MiB for {large} nodes')
+	print(f'Climb memory per node: {per_node:.0f} bytes')
+	if per_node > budget:
+		print(f'FAIL: climb takes more than {budget:.0f} bytes per node')
+		failed = True
+
+	if failed:
+		sys.exit(1)
+	print('Memory benchmark passed!')
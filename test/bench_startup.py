@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+import sys
+import time
+import statistics
+import subprocess
+
+# Guards the startup time of info-only commands, which should never have to 
+# import PyYAML or read package metadata.
+# usage: python3 bench_startup.py [runs] [max median ms]
+if __name__ == '__main__':
+	runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+	max_median = float(sys.argv[2]) if len(sys.argv) > 2 else 200.0
+	base_python_cmd = [sys.executable, '../src/treerun/main.py']
+
+	# Modules that must not be imported by info-only commands or by importing
+	# the main module as a library
+	lazy_modules = ['yaml', 'importlib.metadata', 'concurrent.futures', 'subprocess']
+	probe = f"""
+import io, sys, contextlib
+sys.argv = ['trn', '--not-a-flag']
+import treerun.main as trm
+with contextlib.redirect_stdout(io.StringIO()):
+	trm.main(['--codes'])
+	trm.main(['--example'])
+print(','.join(m for m in {lazy_modules!r} if m in sys.modules))
+"""
+	probe_run = subprocess.run(
+		[sys.executable, '-c', probe],
+		capture_output=True, text=True
+	)
+
+	failed = False
+	if probe_run.returncode != 0:
+		print(f'FAIL: could not import the main module\n{probe_run.stderr}')
+		failed = True
+	elif probe_run.stdout.strip() != '':
+		print(f'FAIL: eagerly imported modules: {probe_run.stdout.strip()}')
+		failed = True
+
+	# Wall time of complete interpreter runs
+	results = {}
+	for flag in ['--codes', '--example', '--version']:
+		timings = []
+		for i in range(runs):
+			start = time.perf_counter()
+			subprocess.run(base_python_cmd+[flag], stdout=subprocess.DEVNULL)
+			timings.append(1000*(time.perf_counter()-start))
+		results[flag] = statistics.median(timings)
+
+	print('Flag:\t\tMedian (ms):')
+	for flag, median in results.items():
+		print(f'{flag}\t{median:.1f}')
+		if median > max_median:
+			print(f'FAIL: {flag} is slower than {max_median} ms')
+			failed = True
+
+	if failed:
+		sys.exit(1)
+	print('Startup benchmark passed!')
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+
+import yaml
+
+from treerun import fingerprint
+from treerun.main import Tree
+from treerun.exitcode import TreerunError
+
+# Runs a tree from Python without any prompts, as when embedding the program
+# in other tools, and checks that errors are raised instead of exiting.
+# usage: python3 check_api.py (from the test dir)
+if __name__ == '__main__':
+	failed = False
+	with open('input.yaml', 'r') as f:
+		yaml_data = yaml.safe_load(f)
+
+	# Selections given as expressions and as lists of names
+	tree = Tree(
+		yaml_data,
+		selections={'System':'1', 'Parameter set 2':['param21', 'param23']},
+		interactive=False,
+	)
+	result = tree.climb(mode='Mode 1')
+	print(result)
+	if (not result.ok) or (len(result.successful) != 4):
+		print(f'FAIL: expected 4 successful nodes, got {result.successful}')
+		failed = True
+
+	# Pipelines are given as lists of modes
+	result = asyncio.run(tree.climb_async(mode=['Mode 1', 'x']))
+	print(result)
+	if (not result.ok) or (len(result.records) != 8):
+		print(f'FAIL: expected 8 successful runs, got {len(result.records)}')
+		failed = True
+
+	# Inputs given as dictionaries keep no run state by default
+	if os.path.exists('.tree.yaml.journal'):
+		print('FAIL: a journal was written for an input given as a dictionary')
+		failed = True
+
+	# Cancelling a run kills the running nodes and records the others
+	async def cancel(tree:Tree) -> float:
+		run = asyncio.ensure_future(tree.climb_async(mode='Sleep'))
+		await asyncio.sleep(1)
+		start = time.monotonic()
+		run.cancel()
+		try:
+			await run
+		except asyncio.CancelledError:
+			pass
+		return time.monotonic()-start
+
+	sleep_data = yaml_data | {'Modes':{'Sleep':{'cmd':'sleep 30'}}}
+	tree = Tree(sleep_data, selections={'System':'1'}, jobs=2, interactive=False)
+	elapsed = asyncio.run(cancel(tree))
+	reasons = [r.get('reason') for r in tree.records]
+	print(f'Cancelled after {elapsed:.1f} s: {reasons}')
+	if (elapsed > 10) or (len(tree.records) != 6) or (reasons.count('not started (stopped)') != 4) or tree.stop.is_set():
+		print('FAIL: cancelling did not stop the run and kill its nodes')
+		failed = True
+
+	# Dangling symlinks in run dirs are fingerprinted like other entries
+	with tempfile.TemporaryDirectory() as root:
+		os.symlink(os.path.join(root, 'missing'), os.path.join(root, 'dangling'))
+		try:
+			fingerprint.fingerprint(root)
+		except OSError as e:
+			print(f'FAIL: a dangling symlink could not be fingerprinted: {e}')
+			failed = True
+
+	# Planting creates a missing root dir together with the tree
+	with tempfile.TemporaryDirectory() as tmp:
+		Tree(yaml_data | {'Root':os.path.join(tmp, 'root')}, interactive=False).plant()
+		if not os.path.isdir(os.path.join(tmp, 'root', 'system1', 'param11', 'param21')):
+			print('FAIL: the tree was not planted below a missing root dir')
+			failed = True
+
+	# Concurrent runs of a mode, e.g. shards, keep each other's fingerprints
+	with tempfile.TemporaryDirectory() as root:
+		store_file = os.path.join(root, 'fingerprints')
+		shards = [fingerprint.Fingerprints(store_file, 'Mode 1', root) for _ in range(2)]
+		for k, shard in enumerate(shards):
+			os.mkdir(os.path.join(root, f'node{k}'))
+			shard.finished({'path':f'/node{k}', 'cmd':'./run.sh', 'status':0})
+		for shard in shards:
+			shard.close()
+		kept = fingerprint.Fingerprints(store_file, 'Mode 1', root).nodes
+		if sorted(kept) != ['/node0', '/node1']:
+			print(f'FAIL: concurrent runs lost fingerprints, kept {sorted(kept)}')
+			failed = True
+
+		# Also when they close at the same time
+		shards = [fingerprint.Fingerprints(store_file, 'Mode 2', root) for _ in range(16)]
+		for k, shard in enumerate(shards):
+			shard.finished({'path':f'/node{k}', 'cmd':'./run.sh', 'status':0})
+		threads = [threading.Thread(target=shard.close) for shard in shards]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		kept = fingerprint.Fingerprints(store_file, 'Mode 2', root).nodes
+		if len(kept) != len(shards):
+			print(f'FAIL: runs closing at the same time lost fingerprints, kept {len(kept)} of {len(shards)}')
+			failed = True
+
+	# Plans of inputs given as dictionaries are written and run without any
+	# run state
+	with tempfile.TemporaryDirectory() as tmp:
+		plan_file = os.path.join(tmp, 'plan.json')
+		Tree(
+			yaml_data,
+			selections={'System':'1', 'Parameter set 2':['param21', 'param23']},
+			interactive=False,
+			plan_file=plan_file,
+		).climb(mode='Mode 1')
+		result = Tree(None, from_plan=plan_file, interactive=False).climb()
+		print(result)
+		if (not result.ok) or (len(result.successful) != 4):
+			print(f'FAIL: expected 4 successful nodes from the plan, got {result.successful}')
+			failed = True
+
+	# Job arrays run from root dirs whose names need quoting
+	with tempfile.TemporaryDirectory() as tmp:
+		root = os.path.join(tmp, "it's here")
+		for name in ['a', 'b']:
+			os.makedirs(os.path.join(root, name))
+		array_data = {
+			'Root':root,
+			'Tree':{'Level':['a', 'b']},
+			'Modes':{'Array':{'cmd':'touch done', 'array':'for i in 0 1; do SLURM_ARRAY_TASK_ID=$i "{launcher}" || exit 1; done'}},
+		}
+		Tree(array_data, interactive=False).climb(mode='Array')
+		if not all(os.path.exists(os.path.join(root, name, 'done')) for name in ['a', 'b']):
+			print('FAIL: the job array did not run from a root dir with a quote in its name')
+			failed = True
+
+	# Errors are raised with the exit code of the command line
+	for mode in ['No such mode', 'Mode 2']:
+		try:
+			Tree(yaml_data, interactive=False).climb(mode=mode)
+			print(f'FAIL: {mode} did not raise')
+			failed = True
+		except TreerunError as e:
+			print(f'{mode}: {e}')
+
+	if failed:
+		sys.exit(1)
+	print('API check passed!')
@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+
+import sys
+import json
+
+# Checks the JSON Lines logs (--json-log) written by the tests.
+# usage: python3 check_logs.py nodes TOTAL FILE...
+#          the files run disjoint sets of nodes that together cover TOTAL 
+#          nodes, e.g. the shards of a run
+#        python3 check_logs.py started-below MAX FILE...
+#          fewer than MAX nodes were started, e.g. after aborting a run
+#        python3 check_logs.py final-status STATUS FILE...
+#          the last record of every node has the exit status STATUS, e.g.
+#          after retrying
+#        python3 check_logs.py fields FIELD,... FILE...
+#          every record has the given fields
+def read_paths(file:str, started:bool=False) -> set:
+	paths = set()
+	with open(file, 'r') as f:
+		for line in f:
+			record = json.loads(line)
+			if (not started) or (record['status'] is not None):
+				paths.add(record['path'])
+	return paths
+
+if __name__ == '__main__':
+	check, files = sys.argv[1], sys.argv[3:]
+	number = int(sys.argv[2]) if sys.argv[2].lstrip('-').isdigit() else None
+	if check == 'nodes':
+		shards = [read_paths(file) for file in files]
+		covered = set().union(*shards)
+		overlap = sum(len(shard) for shard in shards)-len(covered)
+		print(f'{len(files)} logs with {len(covered)} nodes, {overlap} in more than one')
+		failed = (overlap != 0) or (len(covered) != number)
+	elif check == 'started-below':
+		started = set().union(*[read_paths(file, started=True) for file in files])
+		print(f'{len(started)} nodes were started')
+		failed = len(started) >= number
+	elif check == 'final-status':
+		final = {}
+		for file in files:
+			with open(file, 'r') as f:
+				for line in f:
+					record = json.loads(line)
+					final[record['path']] = record['status']
+		other = [path for path, status in final.items() if status != number]
+		print(f'{len(final)} nodes, {len(other)} ended with another status than {number}')
+		failed = (len(final) == 0) or (len(other) > 0)
+	elif check == 'fields':
+		fields, missing, count = sys.argv[2].split(','), set(), 0
+		for file in files:
+			with open(file, 'r') as f:
+				for line in f:
+					missing.update(field for field in fields if field not in json.loads(line))
+					count += 1
+		print(f'{count} records, missing fields: {", ".join(sorted(missing)) or "none"}')
+		failed = (count == 0) or (len(missing) > 0)
+	else:
+		print(f'Unknown check: {check}')
+		failed = True
+	sys.exit(1 if failed else 0)
@@ -0,0 +1,7 @@
+#!/bin/bash
+
+# Stand-in for a batch scheduler: runs every task of a job array locally
+# usage: ./fake_submit.sh FIRST LAST LAUNCHER
+for i in $(seq $1 $2); do
+	SLURM_ARRAY_TASK_ID=$i $3 || exit 1
+done
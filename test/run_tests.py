@@ -1,7 +1,9 @@
 #!/usr/bin/python3
 
 import os
+import re
 import yaml
+import shutil
 import subprocess
 from tabulate import tabulate
 
@@ -29,7 +31,10 @@ if __name__ == '__main__':
 	if not os.path.isdir(log_dir):
 		os.mkdir(log_dir)
 	for file in os.listdir(log_dir):
-		os.remove(f'{log_dir}{file}')
+		if os.path.isdir(f'{log_dir}{file}'):
+			shutil.rmtree(f'{log_dir}{file}')
+		else:
+			os.remove(f'{log_dir}{file}')
 
 	results = []
 	for i, (test, definition) in enumerate(conf['tests'].items()):
@@ -47,21 +52,32 @@ if __name__ == '__main__':
 		stdout = log_dir+definition['stdout']
 
 		# Generate run command
-		prompt_selection = r'\n'.join([l for l in str(definition['selection'])])#+r'\n'
+		# Selections are given one character per prompt, or as a list when an
+		# answer is longer than one character
+		if type(definition['selection']) == list:
+			prompt_selection = r'\n'.join([str(l) for l in definition['selection']])
+		else:
+			prompt_selection = r'\n'.join([l for l in str(definition['selection'])])#+r'\n'
+		flags = definition.get('flags', '')
+		input_file = definition.get('input', conf['input'])
 		if 'all' in definition.keys():
 			# run with -a
 			if 'mod' in definition.keys():
 				modifier = definition['mod']
-				cmd = f'echo \'{prompt_selection}\' | {base_python_cmd} -i {input_file} -o {log} -m {modifier} -a >> {stdout}'
+				cmd = f'echo \'{prompt_selection}\' | {base_python_cmd} -i {input_file} -o {log} -m {modifier} -a {flags} >> {stdout}'
 			else:
-				cmd = f'echo \'{prompt_selection}\' | {base_python_cmd} -i {input_file} -o {log} -a >> {stdout}'
+				cmd = f'echo \'{prompt_selection}\' | {base_python_cmd} -i {input_file} -o {log} -a {flags} >> {stdout}'
 		else:
 			# do NOT run with -a
 			if 'mod' in definition.keys():
 				modifier = definition['mod']
-				cmd = f'echo \'{prompt_selection}\' | {base_python_cmd} -i {input_file} -o {log} -m {modifier} >> {stdout}'
+				cmd = f'echo \'{prompt_selection}\' | {base_python_cmd} -i {input_file} -o {log} -m {modifier} {flags} >> {stdout}'
 			else:
-				cmd = f'echo \'{prompt_selection}\' | {base_python_cmd} -i {input_file} -o {log} >> {stdout}'
+				cmd = f'echo \'{prompt_selection}\' | {base_python_cmd} -i {input_file} -o {log} {flags} >> {stdout}'
+
+		# Commands that prepare the state a test depends on, e.g. a journal
+		for setup_cmd in definition.get('setup', []):
+			subprocess.call(setup_cmd, shell=True, stdout=subprocess.DEVNULL)
 
 		# Program call
 		return_code = subprocess.call(cmd, shell=True)
@@ -71,16 +87,25 @@ if __name__ == '__main__':
 		extract_digit = lambda x: [int(s) for s in x.split() if s.isdigit()][0]
 		exit_code = None
 		with open(f'{cwd}/{stdout}', 'r') as f:
-			for line in f.readlines():
-				if 'exit code:' in line:
-					exit_code = extract_digit(line)
+			output = f.read()
+		for line in output.splitlines():
+			if 'exit code:' in line:
+				exit_code = extract_digit(line)
+
+		# Patterns that must (output) or must not (absent) match a line of the
+		# output, and commands that check the logs of the test
+		problems = [f'missing output: {p}' for p in definition.get('output', []) if re.search(p, output, re.M) is None]
+		problems += [f'unexpected output: {p}' for p in definition.get('absent', []) if re.search(p, output, re.M) is not None]
+		problems += [f'failed check: {c}' for c in definition.get('check', []) if subprocess.call(c, shell=True) != 0]
+		for problem in problems:
+			print(problem)
 
 		# Gather expected results
 		expected_return = definition['expectation']['return code']
 		expected_exit = definition['expectation']['exit code']
 
 		# Check if results match
-		if (exit_code == expected_exit) and (return_code == expected_return):
+		if (exit_code == expected_exit) and (return_code == expected_return) and (len(problems) == 0):
 			print('PASS\n')
 			try:
 				os.remove(f'{cwd}/{log}')
@@ -0,0 +1 @@
+echo "Run by a shell in: $(pwd)"